@@ -10,10 +10,14 @@ import numpy as np
 
 class BaseFauna:
     """
-    BaseClass of two animals in the fauna
+    BaseClass of two animals in the fauna. An animal either keeps its own age
+    and weight, or is a thin view of one row in a columnar Population store
     :param: p: default parameters used for calculating different parameters and
     methods
     """
+    __slots__ = ('_age', '_weight', '_population', '_index', '_fitness',
+                 '_fitness_version')
+
     p = {
         'w_birth': None,
         'sigma_birth': None,
@@ -32,15 +36,62 @@ class BaseFauna:
         'F': None,
         'DeltaPhiMax': None
     }
+    p_version = 0
 
     @classmethod
     def set_parameter(cls, new_p):
         """
-        Class method let you set new parameters instead of the default ones
+        Class method let you set new parameters instead of the default ones.
+        Cached fitness values computed with the old parameters are discarded
         :param new_p: dictionary specifying new parameters
         """
         for key in new_p:
             cls.p[key] = new_p[key]
+        cls.p_version += 1
+
+    @classmethod
+    def fitness_vector(cls, age, weight):
+        """
+        Fitness of many animals of the species evaluated as one NumPy
+        expression
+        :param age: array of ages
+        :param weight: array of weights
+        :return: array of fitness values (0-1)
+        """
+        age = np.asarray(age, dtype=np.float64)
+        weight = np.asarray(weight, dtype=np.float64)
+        with np.errstate(over='ignore'):
+            fitness = 1 / (1 + np.exp(cls.p['phi_age'] * (
+                    age - cls.p['a_half']
+            ))) * 1 / (1 + np.exp(-cls.p['phi_weight'] * (
+                    weight - cls.p['w_half'])))
+        return np.where(weight <= 0, 0., fitness)
+
+    @staticmethod
+    def fitness_array(animals):
+        """
+        Fitness of a list of animals. Cached fitness is reused, and the
+        animals whose age or weight changed are evaluated as one NumPy
+        expression per species. The result is also cached in each animal
+        :param animals: list of animal instances
+        :return: array of fitness values in the same order as the list
+        """
+        fitness = np.zeros(len(animals))
+        stale = []
+        for i, animal in enumerate(animals):
+            if (animal._fitness is not None and
+                    animal._fitness_version == animal.p_version):
+                fitness[i] = animal._fitness
+            else:
+                stale.append(i)
+        for animal_class in {type(animals[i]) for i in stale}:
+            rows = [i for i in stale if type(animals[i]) is animal_class]
+            fitness[rows] = animal_class.fitness_vector(
+                [animals[i].age for i in rows],
+                [animals[i].weight for i in rows])
+            for i in rows:
+                animals[i]._set_fitness(fitness[i])
+        return fitness
 
     def __init__(self, age=0, weight=None):
         """
@@ -48,19 +99,78 @@ class BaseFauna:
         :param age: int specifying age of the animal
         :param weight: int specifying weight of the animal
         """
-        self.age = age
-        self.weight = weight
-        self.animal_moved = False
+        self._population = None
+        self._index = None
+        self._age = age
+        self._weight = weight
+        self._fitness = None
+        self._fitness_version = None
         if weight is None:
-            self.weight = np.random.normal(self.p['w_birth'],
-                                           self.p['sigma_birth'])
+            self._weight = np.random.normal(self.p['w_birth'],
+                                            self.p['sigma_birth'])
+
+    @classmethod
+    def view(cls, population, index):
+        """
+        Creates an animal that reads and writes its age and weight in a row
+        of a columnar population store. The view is valid until the
+        store is compacted
+        :param population: Population instance holding the animal
+        :param index: int: row of the animal in the store
+        :return: instance of cls
+        """
+        animal = cls.__new__(cls)
+        animal._population = population
+        animal._index = index
+        animal._fitness = None
+        return animal
+
+    @property
+    def age(self):
+        """
+        :return: int: Current age of the animal
+        """
+        if self._population is None:
+            return self._age
+        return self._population.age_at(self._index)
+
+    @age.setter
+    def age(self, value):
+        if self._population is None:
+            self._age = value
+            self._fitness = None
+        else:
+            self._population.set_age(self._index, value)
+
+    @property
+    def weight(self):
+        """
+        :return: float: Current weight of the animal
+        """
+        if self._population is None:
+            return self._weight
+        return self._population.weight_at(self._index)
+
+    @weight.setter
+    def weight(self, value):
+        if self._population is None:
+            self._weight = value
+            self._fitness = None
+        else:
+            self._population.set_weight(self._index, value)
 
     @property
     def fitness(self):
         """
-        Fitness of the animal is calculated based on current age and weight
+        Fitness of the animal is calculated based on current age and weight.
+        The value is cached until age, weight or parameters change
         :return: New updated value: float (0-1)
         """
+        if self._population is not None:
+            return float(self._population.fitness[self._index])
+        if (self._fitness is not None and
+                self._fitness_version == self.p_version):
+            return self._fitness
         if self.weight <= 0:
             fitness = 0
         else:
@@ -68,8 +178,18 @@ class BaseFauna:
                     self.age - self.p['a_half']
             ))) * 1 / (1 + math.exp(-self.p['phi_weight'] * (
                     self.weight - self.p['w_half'])))
+        self._set_fitness(fitness)
         return fitness
 
+    def _set_fitness(self, fitness):
+        """
+        Caches the fitness of an animal that keeps its own age and weight
+        :param fitness: float
+        """
+        if self._population is None:
+            self._fitness = fitness
+            self._fitness_version = self.p_version
+
     def aging(self):
         """
         Age of the animal increase by one each year
@@ -118,12 +238,68 @@ class BaseFauna:
         else:
             return False
 
+    @classmethod
+    def birth_weights(cls, n_births, rng=None):
+        """
+        Draws the birth weights of many newborns of the species in one call
+        :param n_births: int: number of newborns
+        :param rng: numpy Generator, the global numpy random state is used if
+        None
+        :return: array of weights
+        """
+        normal = np.random.normal if rng is None else rng.normal
+        return normal(cls.p['w_birth'], cls.p['sigma_birth'], n_births)
+
+    @classmethod
+    def death_mask(cls, fitness, rng):
+        """
+        Batched version of check_death for many animals of the species, one
+        uniform number is drawn per animal from rng
+        :param fitness: array of fitness values
+        :param rng: numpy Generator
+        :return: bool array (True where the animal dies)
+        """
+        fitness = np.asarray(fitness)
+        return (fitness == 0) | (rng.random(len(fitness)) <
+                                 cls.p['omega'] * (1 - fitness))
+
+    @classmethod
+    def birth_mask(cls, fitness, weight, n_animals, rng):
+        """
+        Batched version of check_birth for many animals of the species
+        :param fitness: array of fitness values
+        :param weight: array of weights
+        :param n_animals: int or array: possible mating partners of each
+        animal
+        :param rng: numpy Generator
+        :return: bool array (True where the animal is ready to give birth)
+        """
+        fitness = np.asarray(fitness)
+        probability = np.minimum(1, cls.p['gamma'] * fitness *
+                                 (np.asarray(n_animals) - 1))
+        heavy = np.asarray(weight) >= cls.p['zeta'] * (
+                cls.p['w_birth'] + cls.p['sigma_birth'])
+        return heavy & (rng.random(len(fitness)) <= probability)
+
+    @classmethod
+    def migration_mask(cls, fitness, rng):
+        """
+        Decides for many animals of the species if they try to migrate
+        :param fitness: array of fitness values
+        :param rng: numpy Generator
+        :return: bool array (True where the animal migrates)
+        """
+        fitness = np.asarray(fitness)
+        return rng.random(len(fitness)) < cls.p['mu'] * fitness
+
 
 class Herbivore(BaseFauna):
     """
     Subclass that defines a Herbivore
     :param: p: default parameters for a Herbivore
     """
+    __slots__ = ()
+
     p = {
         "w_birth": 8.0,
         "sigma_birth": 1.5,
@@ -152,12 +328,38 @@ class Herbivore(BaseFauna):
         """
         self.weight += appetite * self.p['beta']
 
+    @classmethod
+    def portions(cls, fodder, n_animals):
+        """
+        Fodder eaten by each herbivore when the herbivores of a cell eat in
+        turn and each eats F until the fodder is gone. Found with a
+        cumulative sum of the appetites clipped at the fodder of the cell.
+        Several cells can be fed at once by giving one fodder value and
+        number of herbivores per cell, the herbivores of each cell then
+        follow each other in the result
+        :param fodder: float or array: fodder in each cell
+        :param n_animals: int or array: herbivores in each cell
+        :return: array: fodder eaten by each herbivore in eating order
+        """
+        fodder, n_animals = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(fodder, dtype=np.float64)),
+            np.atleast_1d(np.asarray(n_animals, dtype=np.int64)))
+        appetite = np.full(n_animals.sum(), cls.p['F'], dtype=np.float64)
+        eaten = np.concatenate(([0.], np.cumsum(appetite)))
+        offsets = np.cumsum(n_animals) - n_animals
+        before = eaten[:-1] - np.repeat(eaten[offsets], n_animals)
+        fodder = np.repeat(fodder, n_animals)
+        return (np.minimum(before + appetite, fodder) -
+                np.minimum(before, fodder))
+
 
 class Carnivore(BaseFauna):
     """
     Subclass that defines a Carnivore
     :param: p: Default parameters for a carnivore
     """
+    __slots__ = ()
+
     p = {
         "w_birth": 6.0,
         "sigma_birth": 1.0,
@@ -203,19 +405,80 @@ class Carnivore(BaseFauna):
         """
         Carnivore tries to eat Herbivores in cell by order of lowest fitness
         until its appetite is full or it has tried to kill every herbivore in
-        cell. weight and fitness is calculated every time Carnivore kills
+        cell. weight and fitness is calculated every time Carnivore kills.
+        pop_herb must be sorted by descending fitness, the survivors are
+        compacted in place once after the hunt
         :return: list: herbivore survivors
         """
+        killed = [False] * len(pop_herb)
+        self.hunt(pop_herb, killed)
+        pop_herb[:] = [herb for herb, dead in zip(pop_herb, killed)
+                       if not dead]
+        return pop_herb
+
+    def hunt(self, pop_herb, killed):
+        """
+        Carnivore tries to kill the herbivores not yet killed, starting with
+        the least fit. Since pop_herb is sorted by descending fitness the hunt
+        stops at the first herbivore at least as fit as the carnivore
+        :param pop_herb: list of herbivores sorted by descending fitness
+        :param killed: list of bools, one per herbivore, updated in place
+        """
         herb_eaten = 0
 
-        for herb in pop_herb[::-1]:
+        for i in range(len(pop_herb) - 1, -1, -1):
+            if killed[i]:
+                continue
+            herb = pop_herb[i]
+            if herb.fitness >= self.fitness:
+                break
             if self.prob_eating(herb):
                 herb_eaten += herb.weight
+                killed[i] = True
                 if herb_eaten >= self.p['F']:
                     self.weight += (herb_eaten - self.p['F'])*self.p['beta']
-                    pop_herb.remove(herb)
                     break
-                elif herb_eaten < self.p['F']:
+                else:
                     self.weight += herb.weight*self.p['beta']
-                    pop_herb.remove(herb)
-        return pop_herb
+
+    @classmethod
+    def predation(cls, age, weight, prey_fitness, prey_weight, killed, rng):
+        """
+        Predation engine for one carnivore on arrays of prey sorted by
+        ascending fitness. Each step finds the first prey killed with the
+        current fitness of the carnivore by comparing a vector of random
+        numbers with the kill probabilities. The scan never goes past the
+        first prey at least as fit as the carnivore
+        :param age: int: age of the carnivore
+        :param weight: float: weight of the carnivore
+        :param prey_fitness: array of prey fitness, ascending
+        :param prey_weight: array of prey weights in the same order
+        :param killed: bool array, one per prey, updated in place
+        :param rng: numpy Generator
+        :return: float: new weight of the carnivore
+        """
+        herb_eaten = 0
+        fitness = float(cls.fitness_vector(age, weight))
+        start = 0
+        draws = np.empty(0)
+        while True:
+            end = int(np.searchsorted(prey_fitness, fitness, side='left'))
+            if start >= end:
+                break
+            if len(draws) < end:
+                draws = np.concatenate((draws,
+                                        rng.random(end - len(draws))))
+            prob = (fitness - prey_fitness[start:end]) / cls.p['DeltaPhiMax']
+            hits = (draws[start:end] < prob) & ~killed[start:end]
+            if not hits.any():
+                break
+            i = start + int(np.argmax(hits))
+            killed[i] = True
+            herb_eaten += prey_weight[i]
+            if herb_eaten >= cls.p['F']:
+                weight += (herb_eaten - cls.p['F']) * cls.p['beta']
+                break
+            weight += prey_weight[i] * cls.p['beta']
+            fitness = float(cls.fitness_vector(age, weight))
+            start = i + 1
+        return weight
@@ -4,7 +4,9 @@ __author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
 __email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
 
 from biosim import Fauna as Fa
+import itertools
 import math
+import numpy as np
 import random as rd
 
 
@@ -13,7 +15,9 @@ class BaseGeography:
     A class that instantiates a cell with area type Ocean, Mountain, Desert,
     Savannah or Jungle. Area types have different qualities. The methods in
     this class and subclass describe how the animals inside a cell eat, migrate
-    and mate. There are also methods for how fodder grows in a cell.
+    and mate. There are also methods for how fodder grows in a cell. The
+    combined herbivore weight is kept up to date by the methods of the cell
+    that add, remove or feed animals.
     :param: geo_p dict: default parameters
     """
     geo_p = {'f_max': None, 'alpha': None}
@@ -28,10 +32,78 @@ class BaseGeography:
             cls.geo_p[key] = new_parameters[key]
 
     def __init__(self):
-        self.pop_herbivores = []
-        self.pop_carnivores = []
-        self.fodder = self.geo_p['f_max']
+        self._pop_herbivores = []
+        self._pop_carnivores = []
+        self._herb_weight = 0
+        self.landscape = None
+        self._fodder = self.geo_p['f_max']
         self.animals_here = True
+        self.population = None
+        self.index = None
+
+    @property
+    def fodder(self):
+        """
+        Fodder in the cell, read from the fodder array of the island if the
+        cell is part of a Landscape
+        :return: float
+        """
+        if self.landscape is None:
+            return self._fodder
+        return self.landscape.fodder_at(self.index)
+
+    @fodder.setter
+    def fodder(self, value):
+        if self.landscape is None:
+            self._fodder = value
+        else:
+            self.landscape.set_fodder(self.index, value)
+
+    def bind_landscape(self, landscape, index):
+        """
+        Let the fodder of the cell be kept in the fodder array of the island
+        :param landscape: Landscape instance
+        :param index: int: index of this cell in the landscape
+        """
+        self.landscape = landscape
+        self.index = index
+
+    def bind(self, population, index):
+        """
+        Let the animals of the cell be kept in a columnar Population store
+        shared by all cells on the island. Animals already in the cell are
+        moved into the store. The yearly phases of a bound cell are run by the
+        store, the cell only answers questions about its animals
+        :param population: Population instance
+        :param index: int: index of this cell in the store
+        """
+        self.population = population
+        self.index = index
+        population.add_animals(self._pop_carnivores + self._pop_herbivores,
+                               index)
+        self._pop_herbivores = []
+        self._pop_carnivores = []
+        self._herb_weight = 0
+
+    @property
+    def pop_herbivores(self):
+        """
+        Herbivores in cell, views of the store rows if the cell is bound
+        :return: list
+        """
+        if self.population is None:
+            return self._pop_herbivores
+        return self.population.animals(self.index, Fa.Herbivore)
+
+    @property
+    def pop_carnivores(self):
+        """
+        Carnivores in cell, views of the store rows if the cell is bound
+        :return: list
+        """
+        if self.population is None:
+            return self._pop_carnivores
+        return self.population.animals(self.index, Fa.Carnivore)
 
     @property
     def pop_total(self):
@@ -41,35 +113,51 @@ class BaseGeography:
         """
         return self.pop_carnivores + self.pop_herbivores
 
+    def animals(self):
+        """
+        Iterates over the carnivores and then the herbivores in the cell
+        without building a new list
+        :return: iterator
+        """
+        return itertools.chain(self.pop_carnivores, self.pop_herbivores)
+
     @property
     def herbivore_pop(self):
         """
         :return: int: Current amount of herbivores in cell
         """
-        return len(self.pop_herbivores)
+        if self.population is not None:
+            return self.population.count(self.index, Fa.Herbivore)
+        return len(self._pop_herbivores)
 
     @property
     def carnivore_pop(self):
         """
         :return: int: Current amount of carnivores in cell
         """
-        return len(self.pop_carnivores)
+        if self.population is not None:
+            return self.population.count(self.index, Fa.Carnivore)
+        return len(self._pop_carnivores)
 
     @property
     def total_pop(self):
         """
         :return: int: Total population in a cell
         """
-        return len(self.pop_total)
+        return self.herbivore_pop + self.carnivore_pop
 
     def populate_cell(self, population_list):
         """
         Populate cell with a list of animals
         :param population_list: list: containing animal instances
         """
+        if self.population is not None:
+            self.population.add_animals(population_list, self.index)
+            return
         for animal in population_list:
             if type(animal).__name__ == 'Herbivore':
                 self.pop_herbivores.append(animal)
+                self._herb_weight += animal.weight
             elif type(animal).__name__ == 'Carnivore':
                 self.pop_carnivores.append(animal)
 
@@ -77,29 +165,57 @@ class BaseGeography:
         """
         Add a single animal to the cell
         """
-        if type(animal).__name__ == 'Herbivore':
+        if self.population is not None:
+            self.population.add_animals([animal], self.index)
+        elif type(animal).__name__ == 'Herbivore':
             self.pop_herbivores.append(animal)
+            self._herb_weight += animal.weight
         else:
             self.pop_carnivores.append(animal)
 
     def remove_animals(self, population_list):
         """
-        Remove a list of animals from the cell
+        Remove a list of animals from the cell. The lists of the cell are
+        compacted once, keeping the order of the remaining animals
         :param population_list: list of animal instances
         """
-        for animal in population_list:
-            if type(animal).__name__ == 'Herbivore':
-                self.pop_herbivores.remove(animal)
-            elif type(animal).__name__ == 'Carnivore':
-                self.pop_carnivores.remove(animal)
-
-    def animals_die(self):
+        if self.population is not None:
+            self.population.remove([animal._index
+                                    for animal in population_list])
+            return
+        leaving = {id(animal) for animal in population_list}
+        if not leaving:
+            return
+        self._herb_weight -= sum(animal.weight for animal in population_list
+                                 if type(animal).__name__ == 'Herbivore')
+        self.pop_herbivores[:] = [herb for herb in self.pop_herbivores
+                                  if id(herb) not in leaving]
+        self.pop_carnivores[:] = [carn for carn in self.pop_carnivores
+                                  if id(carn) not in leaving]
+
+    def animals_die(self, rng=None):
         """
         Method removes the dead animals from a cell
-        """
+        :param rng: numpy Generator, if given all deaths in the cell are
+        decided with one vector of random numbers per species
+        """
+        if rng is not None:
+            for population in (self.pop_herbivores, self.pop_carnivores):
+                if population:
+                    fitness = Fa.BaseFauna.fitness_array(population)
+                    dies = type(population[0]).death_mask(fitness, rng)
+                    if population is self.pop_herbivores:
+                        self._herb_weight -= sum(
+                            animal.weight for animal, dead in
+                            zip(population, dies) if dead)
+                    population[:] = [animal for animal, dead in
+                                     zip(population, dies) if not dead]
+            return
+
         for herb in self.pop_herbivores[::-1]:
             if herb.check_death():
                 self.pop_herbivores.remove(herb)
+                self._herb_weight -= herb.weight
         for carn in self.pop_carnivores[::-1]:
             if carn.check_death():
                 self.pop_carnivores.remove(carn)
@@ -113,8 +229,8 @@ class BaseGeography:
             return 0
         else:
             e_k = self.fodder / ((self.herbivore_pop + 1) *
-                                 Fa.Herbivore().p['F'])
-            return math.exp(Fa.Herbivore().p['landa'] * e_k)
+                                 Fa.Herbivore.p['F'])
+            return math.exp(Fa.Herbivore.p['landa'] * e_k)
 
     def propensity_carn(self):
         """
@@ -125,20 +241,48 @@ class BaseGeography:
             return 0
         else:
             e_k = self.get_herb_weight() / ((self.carnivore_pop + 1) *
-                                            Fa.Carnivore().p['F'])
-            return math.exp(Fa.Carnivore().p['landa'] * e_k)
+                                            Fa.Carnivore.p['F'])
+            return math.exp(Fa.Carnivore.p['landa'] * e_k)
+
+    @staticmethod
+    def propensity_vector(animal_class, food, n_animals, passable):
+        """
+        Propensity of many cells for a species, same formula as
+        propensity_herb and propensity_carn
+        :param animal_class: Herbivore or Carnivore
+        :param food: array: fodder (herbivores) or herbivore weight
+        (carnivores) in each cell
+        :param n_animals: array: animals of the species in each cell
+        :param passable: bool array: False for Ocean and Mountain cells
+        :return: array
+        """
+        e_k = np.asarray(food) / ((np.asarray(n_animals) + 1) *
+                                  animal_class.p['F'])
+        return np.where(passable, np.exp(animal_class.p['landa'] * e_k), 0.)
 
-    def check_migration(self):
+    def check_migration(self, rng=None):
         """
         Method that checks if animals in cell can migrate to another cell.
+        :param rng: numpy Generator, if given the decisions are drawn as one
+        vector of random numbers per species
         :return: list: animals ready to migrate
         """
+        if rng is not None:
+            migrating_animals = []
+            for population in (self.pop_carnivores, self.pop_herbivores):
+                if population:
+                    fitness = Fa.BaseFauna.fitness_array(population)
+                    moves = type(population[0]).migration_mask(fitness, rng)
+                    migrating_animals.extend(
+                        animal for animal, move in zip(population, moves)
+                        if move)
+            return migrating_animals
+
         migrating_animals = []
-        for animal in self.pop_total:
-            if animal.animal_moved is False:
-                prob_move = animal.p['mu'] * animal.fitness
-                if rd.random() < prob_move:
-                    migrating_animals.append(animal)
+        for animal in self.animals():
+            prob_move = animal.p['mu'] * animal.fitness
+            if rd.random() < prob_move:
+                migrating_animals.append(animal)
         return migrating_animals
 
     def fodder_eaten(self):
@@ -163,31 +307,51 @@ class BaseGeography:
     @staticmethod
     def sort_animal_fitness(population):
         """
-        Sorts the herbivores and carnivores in the cell in order of fitness
+        Sorts the herbivores and carnivores in the cell in order of fitness.
+        Only fitness that is out of date is computed, as one NumPy
+        expression. A list that is still in order is left as it is, and a
+        list that is almost in order is cheap to sort again
         :return: sorted list
         """
-        population.sort(key=lambda animal: animal.fitness, reverse=True)
+        fitness = Fa.BaseFauna.fitness_array(population)
+        if np.all(fitness[1:] <= fitness[:-1]):
+            return population
+        order = np.argsort(-fitness, kind='stable')
+        population[:] = [population[i] for i in order]
         return population
 
     def herbivore_eat(self):
         """
-        All the herbivores in cell eat fodder if available
+        All the herbivores in cell eat fodder if available, fittest first.
+        The fodder eaten by each herbivore is found for all of them at once
         """
         self.sort_animal_fitness(self.pop_herbivores)
-        for animal in self.pop_herbivores:
-            animal.eat(self.fodder_eaten())
+        if not self.pop_herbivores:
+            return
+        eaten = Fa.Herbivore.portions(self.fodder, len(self.pop_herbivores))
+        self.fodder -= eaten.sum()
+        for animal, food in zip(self.pop_herbivores, eaten):
+            if food > 0:
+                weight = animal.weight
+                animal.eat(food)
+                self._herb_weight += animal.weight - weight
 
     def carnivore_eat(self):
         """
         All the carnivores in cell tries to eat herbivores in cell. Fittest
-        carnivore is first to go. Herbivores are removed if carnivore is
-        successful
+        carnivore is first to go. Killed herbivores are marked during the hunt
+        and removed together afterwards
         """
         self.sort_animal_fitness(self.pop_carnivores)
         self.sort_animal_fitness(self.pop_herbivores)
+        pop_herbivores = self.pop_herbivores
+        killed = [False] * len(pop_herbivores)
         for carnivore in self.pop_carnivores:
-            pop_herbivores = carnivore.eat(self.pop_herbivores)
-            self.pop_herbivores = pop_herbivores
+            carnivore.hunt(pop_herbivores, killed)
+        self._herb_weight -= sum(herb.weight for herb, dead in
+                                 zip(pop_herbivores, killed) if dead)
+        pop_herbivores[:] = [herb for herb, dead in
+                             zip(pop_herbivores, killed) if not dead]
 
     def get_herb_weight(self):
         """
@@ -195,47 +359,72 @@ class BaseGeography:
         used for calculating propensity
         :return: int
         """
-        herb_weight = 0
-        for herb in self.pop_herbivores:
-            herb_weight += herb.weight
-        return herb_weight
+        if self.population is not None:
+            return self.population.herb_weight(self.index)
+        if not self._pop_herbivores:
+            return 0
+        return self._herb_weight
 
-    def animal_mating(self):
+    def animal_mating(self, rng=None):
         """
         All the animals in the cell try to mate and newborns are added to
-        population if successful
+        population if successful. The birth weights of all mothers of a
+        species are drawn in one call and only the newborns light enough for
+        their mother are created
+        :param rng: numpy Generator, if given the birth checks are drawn as one
+        vector of random numbers per species
         :return:
         """
-        herb_born = []
-        for animal in self.pop_herbivores:
-            if animal.check_birth(self.herbivore_pop):
-                potential_herb = Fa.Herbivore()
-                if animal.p['xi'] * potential_herb.weight > animal.weight:
-                    continue
-                else:
-                    herb_born.append(potential_herb)
-                    animal.weight -= animal.p['xi'] * potential_herb.weight
-
-        carn_born = []
-        for animal in self.pop_carnivores:
-            if animal.check_birth(self.carnivore_pop):
-                potential_carn = Fa.Carnivore()
-                if animal.p['xi'] * potential_carn.weight > animal.weight:
-                    continue
-                else:
-                    carn_born.append(potential_carn)
-                    animal.weight -= animal.p['xi'] * potential_carn.weight
+        for population, animal_class in ((self.pop_herbivores, Fa.Herbivore),
+                                         (self.pop_carnivores, Fa.Carnivore)):
+            mothers = self.mothers(population, rng)
+            if not mothers:
+                continue
+            weights = animal_class.birth_weights(len(mothers), rng)
+            mother_weights = np.array([animal.weight for animal in mothers])
+            xi = animal_class.p['xi']
+            born = xi * weights <= mother_weights
+            for animal, weight, birth in zip(mothers, weights, born):
+                if birth:
+                    animal.weight -= xi * weight
+            if animal_class is Fa.Herbivore:
+                self._herb_weight += (1 - xi) * np.sum(weights[born])
+            population.extend(animal_class(weight=weight)
+                              for weight in weights[born])
 
-        self.pop_herbivores.extend(herb_born)
-        self.pop_carnivores.extend(carn_born)
+    @staticmethod
+    def mothers(population, rng=None):
+        """
+        Finds the animals of one species that are ready to give birth
+        :param population: list of animals of the same species
+        :param rng: numpy Generator, if given the birth checks are drawn as one
+        vector of random numbers
+        :return: list of animals
+        """
+        n_animals = len(population)
+        if rng is None:
+            return [animal for animal in population
+                    if animal.check_birth(n_animals)]
+        if n_animals == 0:
+            return []
+        fitness = Fa.BaseFauna.fitness_array(population)
+        weight = [animal.weight for animal in population]
+        births = type(population[0]).birth_mask(fitness, weight, n_animals,
+                                                rng)
+        return [animal for animal, birth in zip(population, births) if birth]
 
     def age_weightloss(self):
         """
         Animals in cell updates age and weight each year
         """
-        for animal in (self.pop_carnivores + self.pop_herbivores):
+        for animal in self.pop_carnivores:
+            animal.aging()
+            animal.weight_decrease()
+        for animal in self.pop_herbivores:
+            weight = animal.weight
             animal.aging()
             animal.weight_decrease()
+            self._herb_weight += animal.weight - weight
 
     def fodder_growth(self):
         """
@@ -302,3 +491,130 @@ class Mountain(BaseGeography):
     def __init__(self):
         super().__init__()
         self.animals_here = False
+
+
+class Landscape:
+    """
+    Landscape of the whole island kept as arrays. The landscape type of every
+    cell is an integer code in a (rows, cols) grid, and the fodder of every
+    cell is kept in one array indexed by the flat cell index. The cell
+    instances of the map read and write their fodder in this array.
+    Fodder grows lazily: the array holds the fodder of each cell in the year
+    it was last updated, and the fodder of the current year is found in
+    closed form when it is read, f_max - (f_max - f) * (1 - alpha)**k for
+    savannah after k years of growth, f_max for jungle.
+    :param: landscape_classes: tuple: the landscape types, position is code
+    :param: letters: str: map letter of each landscape type, position is code
+    """
+    landscape_classes = (Ocean, Mountain, Desert, Savannah, Jungle)
+    letters = 'OMDSJ'
+
+    def __init__(self, codes):
+        """
+        :param codes: 2D array of landscape codes
+        """
+        self.codes = np.asarray(codes, dtype=np.int8)
+        self.code = self.codes.ravel()
+        self.jungle = self.code == self.letters.index('J')
+        self.savannah = self.code == self.letters.index('S')
+        self.passable = ~np.isin(self.code, [self.letters.index('O'),
+                                             self.letters.index('M')])
+        self._fodder = np.zeros(self.code.size, dtype=np.float64)
+        self._fodder[self.jungle] = Jungle.geo_p['f_max']
+        self._fodder[self.savannah] = Savannah.geo_p['f_max']
+        self.year = 0
+        self.updated = np.zeros(self.code.size, dtype=np.int64)
+        self._params = self.parameters()
+
+    @staticmethod
+    def parameters():
+        """
+        :return: tuple: jungle f_max, savannah f_max and savannah alpha
+        """
+        return (Jungle.geo_p['f_max'], Savannah.geo_p['f_max'],
+                Savannah.geo_p['alpha'])
+
+    @property
+    def fodder(self):
+        """
+        Fodder of every cell in the current year
+        :return: array, position is cell index
+        """
+        self.update()
+        return self._fodder
+
+    def grown(self, fodder, years, jungle, savannah):
+        """
+        Fodder after some years of growth, found in closed form
+        :param fodder: array: fodder when last updated
+        :param years: array: years of growth since last update
+        :param jungle: bool array: True for jungle cells
+        :param savannah: bool array: True for savannah cells
+        :return: array
+        """
+        f_jungle, f_savannah, alpha = self._params
+        fodder = np.where(jungle & (years > 0), f_jungle, fodder)
+        return np.where(savannah, f_savannah - (f_savannah - fodder) *
+                        (1 - alpha) ** years, fodder)
+
+    def update(self, cells=slice(None)):
+        """
+        Brings the fodder of some cells up to the current year
+        :param cells: index, slice or array of cell indices
+        """
+        self._fodder[cells] = self.grown(
+            self._fodder[cells], self.year - self.updated[cells],
+            self.jungle[cells], self.savannah[cells])
+        self.updated[cells] = self.year
+
+    def fodder_of(self, cells):
+        """
+        Fodder of some cells in the current year
+        :param cells: array of cell indices
+        :return: array
+        """
+        self.update(cells)
+        return self._fodder[cells]
+
+    def fodder_at(self, index):
+        """
+        Fodder of one cell in the current year
+        :param index: int: cell index
+        :return: float
+        """
+        if self.updated[index] != self.year:
+            self.update(index)
+        return self._fodder[index]
+
+    def set_fodder(self, index, value):
+        """
+        Sets the fodder of cells in the current year
+        :param index: int or array: cell index
+        :param value: float or array
+        """
+        self._fodder[index] = value
+        self.updated[index] = self.year
+
+    def cell(self, index):
+        """
+        Creates a cell instance of the right landscape type for one cell,
+        with its fodder kept in the fodder array
+        :param index: int: cell index
+        :return: cell instance
+        """
+        cell = self.landscape_classes[self.code[index]]()
+        cell.bind_landscape(self, index)
+        return cell
+
+    def fodder_growth(self):
+        """
+        Fodder grows one year in every jungle and savannah cell on the
+        island. Only the year is counted, the fodder of a cell is found when
+        it is read. If the landscape parameters have changed, the fodder of
+        every cell is first brought up to date with the old parameters
+        """
+        params = self.parameters()
+        if params != self._params:
+            self.update()
+            self._params = params
+        self.year += 1
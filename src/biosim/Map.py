@@ -5,58 +5,201 @@ __email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
 
 from biosim import Geography as Geo
 from biosim import Fauna as Fa
+from biosim import Population as Po
 
+from collections.abc import Mapping, Sequence
+import bisect
+import itertools
+import numpy as np
 import random as rd
 import textwrap
 
 
+class Island(Mapping):
+    """
+    Dictionary like view of the cells of a map with (row, col) tuples as
+    keys. Cells are numbered row by row, and a cell instance is only
+    created when it is first looked up
+    """
+
+    def __init__(self, shape, cells):
+        """
+        :param shape: tuple: number of rows and columns
+        :param cells: Cells of the map, position is cell index
+        """
+        self.shape = shape
+        self.cells = cells
+
+    def index(self, position):
+        """
+        Flat cell index of a position
+        :param position: tuple
+        :return: int
+        """
+        try:
+            row, col = position
+        except (TypeError, ValueError):
+            raise KeyError(position)
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            raise KeyError(position)
+        return row * self.shape[1] + col
+
+    def position(self, index):
+        """
+        Position of a flat cell index
+        :param index: int
+        :return: tuple
+        """
+        return divmod(int(index), self.shape[1])
+
+    def __getitem__(self, position):
+        return self.cells[self.index(position)]
+
+    def __iter__(self):
+        return itertools.product(range(self.shape[0]), range(self.shape[1]))
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+
+class CellIndex(Mapping):
+    """
+    Dictionary like view of the flat cell index of every (row, col) tuple
+    """
+
+    def __init__(self, island):
+        """
+        :param island: Island
+        """
+        self.island = island
+
+    def __getitem__(self, position):
+        return self.island.index(position)
+
+    def __iter__(self):
+        return iter(self.island)
+
+    def __len__(self):
+        return len(self.island)
+
+
+class Cells(Sequence):
+    """
+    Cells of a map in flat index order. A cell instance of the right
+    landscape type is created when the cell is first used, with its fodder
+    kept in the landscape and, for a columnar map, its animals kept in the
+    population store
+    """
+
+    def __init__(self, landscape, population=None):
+        """
+        :param landscape: Landscape
+        :param population: Population instance or None
+        """
+        self.landscape = landscape
+        self.population = population
+        self._cells = {}
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        cell = self._cells.get(index)
+        if cell is None:
+            cell = self.landscape.cell(index)
+            if self.population is not None:
+                cell.bind(self.population, index)
+            self._cells[index] = cell
+        return cell
+
+    def __len__(self):
+        return len(self.landscape.code)
+
+
 class Map:
     """
     Map of the islands biography containing all the cells from Geography based
     on text string code. Map is a dictionary with coordinate tuples as key and
-    instance of area type classes as values
+    instance of area type classes as values. With columnar=True the animals of
+    all cells are kept in one Population store instead of in per-cell lists.
+    If a numpy Generator rng is given, deaths, births and migrations are
+    decided with one vector of random numbers per cell (or for the whole
+    island in the columnar store) instead of one random.random() per animal.
+    Fodder grows on the whole island at once in the Landscape, and only the
+    active cells, land cells with animals, are visited by the other phases
+    of the annual cycle. Animals must be placed with populate_map for their
+    cell to become active. The columnar engine finds the occupied cells from
+    the store and does not keep the set of active cells. The map string is
+    parsed into a grid of landscape codes, and cell instances are only
+    created for the cells that are used
     """
+    _lookup = np.array([Geo.Landscape.letters.find(chr(i))
+                        for i in range(256)], dtype=np.int8)
 
-    def __init__(self, land_string):
-        self.island = {}
+    def __init__(self, land_string, columnar=False, rng=None):
+        self.rng = rng
+        self.population = None
+        self._tables = None
+        self._rows = None
         self.create_map(land_string)
+        self.cell_index = CellIndex(self.island)
+        self.neighbours = self.neighbour_index(self.landscape.codes.shape)
+        self.passable = self.landscape.passable
+        self.active = set()
+        self._census = None
+        self._totals = [0, 0]
+        if columnar:
+            self.population = Po.Population(len(self.cells), rng=rng)
+            self.cells.population = self.population
+
+    @property
+    def coordinates(self):
+        """
+        :return: list: position of every cell, index is cell index
+        """
+        return list(self.island)
 
     def create_map(self, land_string):
         """
         Method that creates a map as a dictionary with coordinates as keys and
-        cell instance as values
+        cell instance as values. The landscape codes and fodder of the cells
+        are kept in a Landscape
         :param land_string: string: letter code for landscape type
         :return: dict: location and geography subclass instances
         """
-        area_list = []
-        for i in land_string:
-            area_list.append(i.strip())
-        while '' in area_list:
-            area_list.remove('')
-        self.check_string(land_string)
-
-        rows = len(land_string.split('\n'))
-        cols = int(len(area_list) / rows)
-        coordinates = [(x, y) for x in range(rows) for y in range(cols)]
-
-        for ind, val in enumerate(area_list):
-            if val == 'O':
-                area_list[ind] = Geo.Ocean()
-            elif val == 'M':
-                area_list[ind] = Geo.Mountain()
-            elif val == 'D':
-                area_list[ind] = Geo.Desert()
-            elif val == 'S':
-                area_list[ind] = Geo.Savannah()
-            else:
-                area_list[ind] = Geo.Jungle()
-
-        for ind, val in enumerate(area_list):
-            self.island[coordinates[ind]] = area_list[ind]
+        self.landscape = Geo.Landscape(self.parse(land_string))
+        self.cells = Cells(self.landscape, self.population)
+        self.island = Island(self.landscape.codes.shape, self.cells)
         return self.island
 
-    @staticmethod
-    def check_string(string):
+    @classmethod
+    def parse(cls, string):
+        """
+        Converts a map string to a grid of landscape codes, checking row
+        lengths, letters and edges with array operations
+        :param string: map description
+        :return: 2D array of landscape codes
+        """
+        rows = textwrap.dedent(string).split('\n')
+        n_cols = len(rows[0])
+        if any(len(row) != n_cols for row in rows):
+            raise ValueError('All rows must have equal length')
+        try:
+            chars = np.frombuffer(''.join(rows).encode('ascii'),
+                                  dtype=np.uint8)
+        except UnicodeEncodeError:
+            raise ValueError('That is an invalid landscape')
+        codes = cls._lookup[chars]
+        if n_cols == 0 or (codes < 0).any():
+            raise ValueError('That is an invalid landscape')
+        codes = codes.reshape(len(rows), n_cols)
+        ocean = Geo.Landscape.letters.index('O')
+        if ((codes[[0, -1]] != ocean).any() or
+                (codes[:, [0, -1]] != ocean).any()):
+            raise ValueError('The edges of the map must be ocean')
+        return codes
+
+    @classmethod
+    def check_string(cls, string):
         """
         Asserts value errors if the string input is not a valid island. Edges
         must be ocean. letters in string must be allowed landscapes. Rows must
@@ -64,38 +207,14 @@ class Map:
         :param: string: map description
         :return: ValueError or nothing if string is valid
         """
-        s = textwrap.dedent(string)
-        rows = s.split('\n')
-        for i in rows[0]:
-            if i is not 'O':
-                raise ValueError('The edges of the map must be ocean')
-        for i in rows[-1]:
-            if i is not 'O':
-                raise ValueError('The edges of the map must be ocean')
-
-        accepted_landscape = ['J', 'S', 'D', 'M', 'O']
-        for string in rows:
-            for cell in string:
-                if cell not in accepted_landscape:
-                    raise ValueError('That is an invalid landscape')
-
-        for i in rows:
-            if i[0] is not 'O':
-                raise ValueError('The edges of the map must be ocean')
-            elif i[-1] is not 'O':
-                raise ValueError('The edges of the map must be ocean')
-
-        n_first_row = len(rows[0])
-        for ind, val in enumerate(rows):
-            if len(rows[ind]) != n_first_row:
-                raise ValueError('All rows must have equal length')
+        cls.parse(string)
 
     def check_input_in_sim(self, pos):
         """
         Check that the inputs in simulation class is acceptable.
         :param pos: tuple
         """
-        if pos not in self.island.keys():
+        if pos not in self.island:
             raise ValueError('The coordinates does not exist on the map')
         elif isinstance(self.island[pos], Geo.Ocean):
             raise ValueError('Animals cannot be located in Ocean cells')
@@ -108,7 +227,56 @@ class Map:
         :param pos: tuple
         :param pop: list
         """
-        self.island[pos].populate_cell(pop)
+        cell = self.island[pos]
+        before = cell.herbivore_pop, cell.carnivore_pop
+        cell.populate_cell(pop)
+        if self.population is None:
+            self.active.add(self.cell_index[pos])
+        self._census = None
+        self._tally(cell, before)
+
+    def _tally(self, cell, before):
+        """
+        Adds the change in the number of animals in a cell to the island
+        totals of the object engine. The columnar store keeps its own totals
+        :param cell: cell instance
+        :param before: tuple: herbivores and carnivores in the cell before
+        """
+        if self.population is None:
+            self._totals[0] += cell.herbivore_pop - before[0]
+            self._totals[1] += cell.carnivore_pop - before[1]
+
+    @property
+    def totals(self):
+        """
+        Number of herbivores and carnivores on the island, kept up to date
+        as animals are placed, born, killed and die, without visiting the
+        cells
+        :return: tuple: herbivores, carnivores
+        """
+        if self.population is not None:
+            return tuple(int(n) for n in self.population.totals)
+        return tuple(self._totals)
+
+    def active_cells(self):
+        """
+        Indices of the cells visited in the annual cycle, in map order. For
+        the columnar engine these are the cells of the animals in the store
+        :return: list
+        """
+        if self.population is not None:
+            return np.unique(self.population.cell).tolist()
+        return sorted(self.active)
+
+    def update_active(self):
+        """
+        Drops the cells with no animals from the active cells of the object
+        engine
+        """
+        if self.population is not None:
+            return
+        self.active = {index for index in self.active
+                       if self.cells[index].total_pop > 0}
 
     @staticmethod
     def find_neighbor_cells(position):
@@ -123,58 +291,247 @@ class Map:
                       (position[0], position[1] - 1)]  # W
         return neighbours
 
-    def migrate_to(self, position, animal):
+    @staticmethod
+    def neighbour_index(shape):
         """
-        Method that Calculates which neighbour cell the animal migrates to
-        :return: tuple
+        Flat cell index of the four neighbours of every cell on a grid where
+        the cells are numbered row by row. A neighbour outside the grid is
+        replaced by the cell itself
+        :param shape: tuple: number of rows and columns
+        :return: array with shape (cells, 4), neighbours in the same order
+        as find_neighbor_cells
         """
-        neigh = self.find_neighbor_cells(position)
-        propensity_list = []
+        index = np.arange(shape[0] * shape[1]).reshape(shape)
+        south = np.vstack((index[1:], index[-1:]))
+        north = np.vstack((index[:1], index[:-1]))
+        east = np.hstack((index[:, 1:], index[:, -1:]))
+        west = np.hstack((index[:, :1], index[:, :-1]))
+        return np.stack((south, north, east, west), axis=-1).reshape(-1, 4)
 
-        for cell in neigh:
-            if isinstance(animal, Fa.Herbivore):
-                propensity_list.append(self.island[cell].propensity_herb())
-            else:
-                propensity_list.append(self.island[cell].propensity_carn())
-        if sum(propensity_list) == 0:
-            return position
+    def animal_counts(self, cells=None):
+        """
+        Number of animals of each species and combined herbivore weight in
+        some cells
+        :param cells: array of cell indices, None for every cell
+        :return: tuple: array with shape (2, cells) and array of herbivore
+        weights, in the order of cells
+        """
+        if cells is None:
+            cells = np.arange(len(self.cells))
+        if self.population is not None:
+            return (self.population.counts[:, cells],
+                    self.population.herb_weights(cells))
+        counts = np.zeros((2, len(cells)), dtype=np.int64)
+        herb_weights = np.zeros(len(cells))
+        for i, index in enumerate(cells.tolist()):
+            if index in self.active:
+                cell = self.cells[index]
+                counts[0, i] = cell.herbivore_pop
+                counts[1, i] = cell.carnivore_pop
+                herb_weights[i] = cell.get_herb_weight()
+        return counts, herb_weights
 
-        sum_propen = sum(propensity_list)
-        p = []
-        for prop in propensity_list:
-            p.append(prop / sum_propen)
+    def count_grid(self):
+        """
+        Number of animals of each species in every cell, laid out like the
+        map. Only the active cells are visited in the object engine
+        :return: int array with shape (2, rows, cols), herbivores first
+        """
+        if self.population is not None:
+            counts = self.population.counts.copy()
+        else:
+            counts = np.zeros((2, len(self.cells)), dtype=np.int64)
+            for index in self.active:
+                cell = self.cells[index]
+                counts[0, index] = cell.herbivore_pop
+                counts[1, index] = cell.carnivore_pop
+        return counts.reshape((2,) + self.landscape.codes.shape)
+
+    def census(self):
+        """
+        Herbivores and carnivores per cell, laid out like the map. The counts
+        are made once and kept until animals are placed with populate_map or
+        the next annual cycle starts
+        :return: tuple: two read-only int arrays with shape (rows, cols)
+        """
+        if self._census is None:
+            grid = self.count_grid()
+            grid.flags.writeable = False
+            self._census = (grid[0], grid[1])
+        return self._census
+
+    def traits(self, animal_class):
+        """
+        Age, weight and fitness of every animal of a species on the island
+        :param animal_class: Herbivore or Carnivore
+        :return: dict: 'age', 'weight' and 'fitness' arrays
+        """
+        if self.population is not None:
+            pop = self.population
+            rows = pop.species == pop.code(animal_class)
+            return {'age': pop.age[rows], 'weight': pop.weight[rows],
+                    'fitness': pop.fitness[rows]}
+        attribute = ('pop_herbivores' if animal_class is Fa.Herbivore
+                     else 'pop_carnivores')
+        animals = [animal for index in self.active_cells()
+                   for animal in getattr(self.cells[index], attribute)]
+        return {'age': np.array([animal.age for animal in animals],
+                                dtype=np.int64),
+                'weight': np.array([animal.weight for animal in animals],
+                                   dtype=np.float64),
+                'fitness': Fa.BaseFauna.fitness_array(animals)}
 
-        prob = 0
-        probability = []
-        for i in p:
-            prob += i
-            probability.append(prob)
+    def propensities(self, cells=None):
+        """
+        Propensity of some cells for herbivores and carnivores
+        :param cells: array of cell indices, None for every cell
+        :return: tuple of two arrays (herbivores, carnivores), in the order
+        of cells
+        """
+        if cells is None:
+            cells = np.arange(len(self.cells))
+        counts, herb_weights = self.animal_counts(cells)
+        passable = self.passable[cells]
+        return (Geo.BaseGeography.propensity_vector(
+                    Fa.Herbivore, self.landscape.fodder_of(cells), counts[0],
+                    passable),
+                Geo.BaseGeography.propensity_vector(
+                    Fa.Carnivore, herb_weights, counts[1], passable))
 
+    def table(self, index, animal_class):
+        """
+        Cumulative probabilities of moving from a cell to each of its
+        neighbours. During a migration phase the tables found at the start
+        of the phase are used
+        :param index: int: cell index
+        :param animal_class: Herbivore or Carnivore
+        :return: list: four cumulative probabilities, None if no neighbour
+        can be moved to
+        """
+        if self._rows is not None:
+            return self._rows[index, animal_class]
+        table = self.migration_tables(np.array([index]))[
+            Po.Population.code(animal_class), 0]
+        return None if np.isnan(table[-1]) else table.tolist()
+
+    def migration_table(self, position, animal_class):
+        """
+        Cumulative probabilities of moving from a cell to each of its
+        neighbours
+        :param position: tuple
+        :param animal_class: Herbivore or Carnivore
+        :return: list: four cumulative probabilities, None if no neighbour
+        can be moved to
+        """
+        return self.table(self.cell_index[position], animal_class)
+
+    def migrate_from(self, index, animal):
+        """
+        Calculates which neighbour cell an animal migrates to
+        :param index: int: index of the cell the animal is in
+        :param animal: Herbivore or Carnivore
+        :return: int: index of the new cell
+        """
+        probability = self.table(index, type(animal))
+        if probability is None:
+            return index
         a = rd.random()
-        if a <= probability[0]:
-            return neigh[0]
-        elif probability[0] < a <= probability[1]:
-            return neigh[1]
-        elif probability[1] < a <= probability[2]:
-            return neigh[2]
-        else:
-            return neigh[3]
+        return int(self.neighbours[index,
+                                   min(bisect.bisect_left(probability, a), 3)])
+
+    def migrate_to(self, position, animal):
+        """
+        Method that Calculates which neighbour cell the animal migrates to
+        :return: tuple
+        """
+        return self.island.position(
+            self.migrate_from(self.island.index(position), animal))
 
     def move(self):
         """
-        The animals in the cells move from one cell to another
+        The animals in the cells move from one cell to another. The
+        migration tables of the active cells are found once at the start of
+        the phase. All moves are collected from the cells as they were
+        before migration and applied afterwards, so an animal cannot move
+        twice in a year
         """
-        for loc, cell in self.island.items():
-            moving_animals = cell.check_migration()
-            for animal in moving_animals:
-                new_cell = self.migrate_to(loc, animal)
-                self.island[new_cell].add_animal(animal)
-                animal.animal_moved = True
+        if self.population is not None:
+            self.move_population()
+            return
+
+        active = self.active_cells()
+        tables = self.migration_tables(np.array(active, dtype=np.int64))
+        blocked = np.isnan(tables[..., -1]).tolist()
+        tables = tables.tolist()
+        self._rows = {}
+        for code, animal_class in enumerate(Po.Population.animal_classes):
+            for index, table, stays in zip(active, tables[code],
+                                           blocked[code]):
+                self._rows[index, animal_class] = None if stays else table
+        arrivals = []
+        for index in active:
+            cell = self.cells[index]
+            moving_animals = cell.check_migration(self.rng)
+            arrivals.extend((self.migrate_from(index, animal), animal)
+                            for animal in moving_animals)
             cell.remove_animals(moving_animals)
 
-        for loc, cell in self.island.items():
-            for animal in cell.pop_total:
-                animal.animal_moved = False
+        for new_index, animal in arrivals:
+            self.cells[new_index].add_animal(animal)
+            self.active.add(new_index)
+        self._rows = None
+
+    def migration_tables(self, cells=None):
+        """
+        Cumulative probabilities of moving from cells to each of their
+        four neighbours, for both species, found with array operations.
+        Only the propensities of the neighbours are found. Rows of cells
+        with no neighbour to move to are nan
+        :param cells: array of cell indices, None for every cell
+        :return: array with shape (species, cells, 4)
+        """
+        neighbours = self.neighbours if cells is None else (
+            self.neighbours[cells])
+        targets, inverse = np.unique(neighbours, return_inverse=True)
+        propensity = np.stack(self.propensities(targets))[
+            :, inverse.reshape(neighbours.shape)]
+        total = propensity.sum(axis=2, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.cumsum(propensity / total, axis=2)
+
+    def destinations(self, tables, cells, species, uniforms, rows=None):
+        """
+        Destination cell of many migrating animals, chosen with one
+        comparison of their random numbers against the migration tables
+        :param tables: array from migration_tables
+        :param cells: array: cell index of each animal
+        :param species: array: species code of each animal
+        :param uniforms: array: one random number in [0, 1) per animal
+        :param rows: array: row of each animal in tables, None if tables
+        were found for every cell
+        :return: array of cell indices, animals that cannot move stay
+        """
+        probability = tables[species, cells if rows is None else rows]
+        choice = np.minimum((probability < uniforms[:, None]).sum(axis=1), 3)
+        new_cells = self.neighbours[cells, choice]
+        return np.where(np.isnan(probability[:, -1]), cells, new_cells)
+
+    def move_population(self):
+        """
+        The animals in the population store move from one cell to another.
+        Which animals move and where they go is decided for the whole island
+        at once, with migration tables for the cells that animals leave, and
+        all moves are applied together
+        """
+        population = self.population
+        moving = np.flatnonzero(population.migration_mask())
+        cells = population.cell[moving]
+        origins, rows = np.unique(cells, return_inverse=True)
+        new_cells = self.destinations(self.migration_tables(origins), cells,
+                                      population.species[moving],
+                                      population.rng.random(len(moving)),
+                                      rows)
+        population.move(moving, new_cells)
 
     def annual_cycle(self):
         """
@@ -188,12 +545,32 @@ class Map:
         6) Loss of weight
         7) Death
         """
-        for coord, land in self.island.items():
-            land.fodder_growth()
+        self._census = None
+        self.landscape.fodder_growth()
+        if self.population is not None:
+            grazed = self.population.segments(Fa.Herbivore)[0]
+            fodder = self.landscape.fodder_of(grazed)
+            self.population.herbivores_eat(fodder, grazed)
+            self.landscape.set_fodder(grazed, fodder)
+            self.population.carnivores_eat()
+            self.population.mating()
+            self.move()
+            self.population.aging()
+            self.population.dying()
+            return
+
+        for index in self.active_cells():
+            land = self.cells[index]
+            before = land.herbivore_pop, land.carnivore_pop
             land.herbivore_eat()
             land.carnivore_eat()
-            land.animal_mating()
+            land.animal_mating(self.rng)
+            self._tally(land, before)
         self.move()
-        for coord, land in self.island.items():
+        for index in self.active_cells():
+            land = self.cells[index]
+            before = land.herbivore_pop, land.carnivore_pop
             land.age_weightloss()
-            land.animals_die()
+            land.animals_die(self.rng)
+            self._tally(land, before)
+        self.update_active()
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
+__email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
+
+from biosim import Fauna as Fa
+import numpy as np
+
+
+class Population:
+    """
+    Columnar store holding every animal on the island. Each attribute of the
+    animals is kept in its own NumPy array (birth year, weight, cell index,
+    species code) and row i of all arrays is one animal. Herbivore and
+    Carnivore instances handed out by the store are thin views of a row.
+    Aging is lazy: the store counts years, the age of an animal is found
+    from its birth year, and its weight is kept together with the year it
+    was set. The yearly weight loss since then, w * (1 - eta)**k after k
+    years, is applied when the weight is read. Fitness is cached per animal
+    and only recomputed for the rows whose age or weight changed. Deaths,
+    births and migrations are decided for the whole island with one vector
+    of random numbers drawn from a numpy Generator.
+    :param: animal_classes: tuple: the species, position is the species code
+    """
+    animal_classes = (Fa.Herbivore, Fa.Carnivore)
+    _columns = ('_birth', '_weight', '_weight_year', '_cell', '_species',
+                '_fitness', '_stale')
+
+    def __init__(self, n_cells, capacity=1024, rng=None):
+        """
+        :param n_cells: int: number of cells on the island
+        :param capacity: int: number of animals to allocate room for
+        :param rng: numpy Generator, a new one is made if None
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be a positive number of animals')
+        if rng is None:
+            rng = np.random.default_rng()
+        self.rng = rng
+        self.n_cells = n_cells
+        self.size = 0
+        self.year = 0
+        self._birth = np.zeros(capacity, dtype=np.int64)
+        self._weight = np.zeros(capacity, dtype=np.float64)
+        self._weight_year = np.zeros(capacity, dtype=np.int64)
+        self._weights_year = 0
+        self._cell = np.zeros(capacity, dtype=np.int64)
+        self._species = np.zeros(capacity, dtype=np.int8)
+        self._fitness = np.zeros(capacity, dtype=np.float64)
+        self._stale = np.zeros(capacity, dtype=bool)
+        self._any_stale = False
+        self._p_versions = self._parameter_versions()
+        self._fitness_year = 0
+        self._eta = self._weight_loss()
+        self.counts = np.zeros((len(self.animal_classes), n_cells),
+                               dtype=np.int64)
+        self.totals = np.zeros(len(self.animal_classes), dtype=np.int64)
+        self._herb_weight = None
+        self._order = [None] * len(self.animal_classes)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def age(self):
+        """
+        :return: array: age of every animal in the store, a new array
+        """
+        return self.year - self._birth[:self.size]
+
+    @property
+    def weight(self):
+        """
+        :return: array: weight of every animal in the store
+        """
+        if self._weights_year != self.year:
+            self._update_weights(slice(None))
+            self._weights_year = self.year
+        return self._weight[:self.size]
+
+    def age_at(self, index):
+        """
+        :param index: int: row index
+        :return: int: age of one animal
+        """
+        return self.year - int(self._birth[index])
+
+    def weight_at(self, index):
+        """
+        :param index: int: row index
+        :return: float: weight of one animal
+        """
+        if self._weight_year[index] != self.year:
+            self._update_weights(index)
+        return float(self._weight[index])
+
+    def _weight_loss(self):
+        """
+        :return: array: yearly weight loss eta of each species
+        """
+        return np.array([animal_class.p['eta']
+                         for animal_class in self.animal_classes],
+                        dtype=np.float64)
+
+    def _update_weights(self, rows):
+        """
+        Applies the weight loss of the years since the weight of the rows
+        was set
+        :param rows: index, array or slice of rows
+        """
+        years = self.year - self._weight_year[:self.size][rows]
+        eta = self._eta[self._species[:self.size][rows]]
+        self._weight[:self.size][rows] *= (1 - eta) ** years
+        self._weight_year[:self.size][rows] = self.year
+
+    @property
+    def cell(self):
+        """
+        :return: array: index of the cell every animal is located in
+        """
+        return self._cell[:self.size]
+
+    @property
+    def species(self):
+        """
+        :return: array: species code of every animal in the store
+        """
+        return self._species[:self.size]
+
+    @property
+    def fitness(self):
+        """
+        Fitness of every animal. The rows whose age or weight changed since
+        the last call are recomputed with one NumPy expression per species
+        :return: array
+        """
+        versions = self._parameter_versions()
+        if versions != self._p_versions or self._fitness_year != self.year:
+            self._p_versions = versions
+            self._fitness_year = self.year
+            self._changed(slice(None))
+        if self._any_stale:
+            rows = np.flatnonzero(self._stale[:self.size])
+            species = self.species[rows]
+            for code, animal_class in enumerate(self.animal_classes):
+                changed = rows[species == code]
+                self._fitness[changed] = animal_class.fitness_vector(
+                    self.age[changed], self.weight[changed])
+            self._stale[rows] = False
+            self._any_stale = False
+        return self._fitness[:self.size]
+
+    @classmethod
+    def _parameter_versions(cls):
+        """
+        :return: tuple: parameter version of each species
+        """
+        return tuple(animal_class.p_version
+                     for animal_class in cls.animal_classes)
+
+    def _changed(self, rows):
+        """
+        Marks the fitness of rows as out of date after age or weight changed
+        :param rows: index, array or slice of rows
+        """
+        self._stale[:self.size][rows] = True
+        self._any_stale = True
+        self._herb_weight = None
+
+    @classmethod
+    def code(cls, animal_class):
+        """
+        Species code used in the store for an animal class
+        :param animal_class: Herbivore or Carnivore class
+        :return: int
+        """
+        return cls.animal_classes.index(animal_class)
+
+    def _reserve(self, n_new):
+        """
+        Makes room for n_new more animals, the arrays double in size when
+        they are full
+        :param n_new: int
+        """
+        capacity = len(self._weight)
+        if self.size + n_new <= capacity:
+            return
+        while capacity < self.size + n_new:
+            capacity *= 2
+        for name in self._columns:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add(self, species, age, weight, cell):
+        """
+        Appends animals to the store. Scalars are broadcast to the length of
+        the other arguments
+        :param species: int or array: species code
+        :param age: int or array
+        :param weight: float or array
+        :param cell: int or array: cell index
+        """
+        species, age, weight, cell = np.broadcast_arrays(
+            *map(np.atleast_1d, (species, age, weight, cell)))
+        n_new = len(weight)
+        if n_new == 0:
+            return
+        self._reserve(n_new)
+        rows = slice(self.size, self.size + n_new)
+        self._species[rows] = species
+        self._birth[rows] = self.year - age
+        self._weight[rows] = weight
+        self._weight_year[rows] = self.year
+        self._cell[rows] = cell
+        self.size += n_new
+        np.add.at(self.counts, (species, cell), 1)
+        self.totals += np.bincount(species, minlength=len(self.totals))
+        self._changed(rows)
+        self._order = [None] * len(self.animal_classes)
+
+    def add_animals(self, animals, cell):
+        """
+        Copies Herbivore and Carnivore instances into the store, other objects
+        are ignored
+        :param animals: list of animal instances
+        :param cell: int: cell index
+        """
+        animals = [animal for animal in animals
+                   if type(animal) in self.animal_classes]
+        self.add(np.array([self.code(type(animal)) for animal in animals],
+                          dtype=np.int8),
+                 np.array([animal.age for animal in animals], dtype=np.int64),
+                 np.array([animal.weight for animal in animals],
+                          dtype=np.float64),
+                 cell)
+
+    def keep(self, mask):
+        """
+        Compacts the store so that only the animals where mask is True are
+        left. Views handed out before are invalid afterwards
+        :param mask: bool array with one value per animal
+        """
+        n_keep = int(np.count_nonzero(mask))
+        species = self.species[~mask]
+        self.totals -= np.bincount(species, minlength=len(self.totals))
+        np.subtract.at(self.counts, (species, self.cell[~mask]), 1)
+        for name in self._columns:
+            column = getattr(self, name)
+            column[:n_keep] = column[:self.size][mask]
+        self.size = n_keep
+        self._herb_weight = None
+        self._order = [None] * len(self.animal_classes)
+
+    def remove(self, indices):
+        """
+        Removes the animals in the given rows
+        :param indices: list or array of row indices
+        """
+        mask = np.ones(self.size, dtype=bool)
+        mask[np.asarray(indices, dtype=np.int64)] = False
+        self.keep(mask)
+
+    def move(self, indices, cells):
+        """
+        Moves animals to new cells
+        :param indices: array of row indices
+        :param cells: array of new cell indices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        cells = np.broadcast_to(cells, indices.shape)
+        species = self.species[indices]
+        np.add.at(self.counts, (species, self.cell[indices]), -1)
+        np.add.at(self.counts, (species, cells), 1)
+        self._herb_weight = None
+        self.cell[indices] = cells
+        self._order = [None] * len(self.animal_classes)
+
+    def set_weight(self, rows, value):
+        """
+        Sets the weight of the animals in the given rows
+        :param rows: int or array of row indices
+        :param value: float or array
+        """
+        self._weight[:self.size][rows] = value
+        self._weight_year[:self.size][rows] = self.year
+        self._changed(rows)
+
+    def set_age(self, rows, value):
+        """
+        Sets the age of the animals in the given rows
+        :param rows: int or array of row indices
+        :param value: int or array
+        """
+        self._birth[:self.size][rows] = self.year - np.asarray(value)
+        self._changed(rows)
+
+    def count(self, cell=None, animal_class=None):
+        """
+        Number of animals in a cell and/or of a species
+        :param cell: int: cell index, None counts the whole island
+        :param animal_class: Herbivore or Carnivore, None counts both
+        :return: int
+        """
+        if cell is None:
+            counts = self.totals
+        else:
+            counts = self.counts[:, cell]
+        if animal_class is not None:
+            return int(counts[self.code(animal_class)])
+        return int(np.sum(counts))
+
+    def herb_weights(self, cells=None):
+        """
+        Combined weight of the herbivores in some cells. The weights are
+        summed per occupied cell and kept until a weight changes or animals
+        are added, removed or moved
+        :param cells: array of cell indices, None for every cell
+        :return: array, in the order of cells
+        """
+        if self._herb_weight is None:
+            herbs = self.species == self.code(Fa.Herbivore)
+            occupied, inverse = np.unique(self.cell[herbs],
+                                          return_inverse=True)
+            self._herb_weight = (occupied, np.bincount(
+                inverse, weights=self.weight[herbs], minlength=len(occupied)))
+        occupied, weights = self._herb_weight
+        if cells is None:
+            cells = np.arange(self.n_cells)
+        cells = np.asarray(cells, dtype=np.int64)
+        if len(occupied) == 0:
+            return np.zeros(len(cells))
+        positions = np.minimum(np.searchsorted(occupied, cells),
+                               len(occupied) - 1)
+        return np.where(occupied[positions] == cells, weights[positions], 0.)
+
+    def herb_weight(self, cell):
+        """
+        Combined weight of the herbivores in a cell
+        :param cell: int: cell index
+        :return: float
+        """
+        return float(self.herb_weights([cell])[0])
+
+    def view(self, index):
+        """
+        :param index: int: row index
+        :return: Herbivore or Carnivore view of the animal in row index
+        """
+        animal_class = self.animal_classes[self.species[index]]
+        return animal_class.view(self, int(index))
+
+    def animals(self, cell, animal_class):
+        """
+        Views of all animals of a species in a cell
+        :param cell: int: cell index
+        :param animal_class: Herbivore or Carnivore
+        :return: list
+        """
+        rows = np.flatnonzero((self.cell == cell) &
+                              (self.species == self.code(animal_class)))
+        return [animal_class.view(self, int(i)) for i in rows]
+
+    def fitness_order(self, animal_class):
+        """
+        Rows of the animals of a species sorted by cell and, within a cell,
+        fittest first. Equal fitness keeps the earlier order. The order is
+        kept until animals are added, removed or moved. If only weights
+        changed since it was made, the order is reused if still sorted and
+        otherwise only the cells that are out of order are sorted again
+        :param animal_class: Herbivore or Carnivore
+        :return: array of row indices, the animals of cell c follow the
+        animals of the cells before it
+        """
+        code = self.code(animal_class)
+        fitness = self.fitness
+        rows = self._order[code]
+        if rows is None:
+            rows = np.flatnonzero(self.species == code)
+            rows = rows[np.lexsort((-fitness[rows], self.cell[rows]))]
+            self._order[code] = rows
+            return rows
+        cells = self.cell[rows]
+        unsorted = (cells[1:] == cells[:-1]) & (fitness[rows[1:]] >
+                                                fitness[rows[:-1]])
+        if unsorted.any():
+            positions = np.flatnonzero(np.isin(cells,
+                                               cells[1:][unsorted]))
+            resort = rows[positions]
+            rows[positions] = resort[np.lexsort((-fitness[resort],
+                                                 self.cell[resort]))]
+        return rows
+
+    def segments(self, animal_class):
+        """
+        The occupied cells of a species and where their animals start and
+        end in fitness_order. Only the ordered rows are visited, so the cost
+        does not depend on the number of cells on the island
+        :param animal_class: Herbivore or Carnivore
+        :return: three arrays: sorted cell indices, start and end positions
+        """
+        rows = self.fitness_order(animal_class)
+        cells = self.cell[rows]
+        first = np.ones(len(cells), dtype=bool)
+        first[1:] = cells[1:] != cells[:-1]
+        start = np.flatnonzero(first)
+        end = np.append(start[1:], len(cells))
+        return cells[start], start, end
+
+    def herbivores_eat(self, fodder, cells=None):
+        """
+        The herbivores in every cell eat fodder in order of fitness. The
+        herbivores are sorted by cell and fitness, the fodder eaten by each
+        is found for the whole island at once and all weights are updated
+        together
+        :param fodder: array: fodder in each of the cells, the eaten fodder
+        is subtracted in place
+        :param cells: sorted array of cell indices holding every herbivore,
+        None for every cell
+        """
+        if cells is None:
+            cells = np.arange(self.n_cells)
+        herbs = self.fitness_order(Fa.Herbivore)
+        n_herbs = self.counts[self.code(Fa.Herbivore), cells]
+        eaten = Fa.Herbivore.portions(fodder, n_herbs)
+        fodder -= np.bincount(np.repeat(np.arange(len(cells)), n_herbs),
+                              weights=eaten, minlength=len(cells))
+        self.set_weight(herbs, self.weight[herbs] +
+                        eaten * Fa.Herbivore.p['beta'])
+
+    def carnivores_eat(self):
+        """
+        The carnivores in every cell hunt the herbivores in the same cell,
+        fittest carnivore first. Only the occupied cells with both species
+        are visited. The herbivores of a cell are hunted as arrays sorted by
+        fitness with a kill mask, and all killed herbivores are removed
+        together afterwards
+        """
+        herbs = self.fitness_order(Fa.Herbivore)
+        carns = self.fitness_order(Fa.Carnivore)
+        fitness = self.fitness
+        herb_cells, herb_start, herb_end = self.segments(Fa.Herbivore)
+        carn_cells, carn_start, carn_end = self.segments(Fa.Carnivore)
+        killed_rows = []
+        _, hunted, hunting = np.intersect1d(
+            herb_cells, carn_cells, assume_unique=True, return_indices=True)
+        for h, c in zip(hunted.tolist(), hunting.tolist()):
+            prey = herbs[herb_start[h]:herb_end[h]][::-1]
+            prey_fitness = fitness[prey]
+            prey_weight = self.weight[prey]
+            killed = np.zeros(len(prey), dtype=bool)
+            for carn in carns[carn_start[c]:carn_end[c]]:
+                weight = self.weight_at(carn)
+                new_weight = Fa.Carnivore.predation(
+                    self.age_at(carn), weight, prey_fitness, prey_weight,
+                    killed, self.rng)
+                if new_weight != weight:
+                    self.set_weight(carn, new_weight)
+            killed_rows.append(prey[killed])
+        if killed_rows:
+            self.remove(np.concatenate(killed_rows))
+
+    def species_rows(self):
+        """
+        Row indices of the animals of each species
+        :return: list of (species code, animal class, row index array)
+        """
+        return [(code, animal_class, np.flatnonzero(self.species == code))
+                for code, animal_class in enumerate(self.animal_classes)]
+
+    def mating(self):
+        """
+        The animals in every cell try to give birth, newborns are added to
+        the cell of the mother. The birth checks and birth weights of the
+        whole island are drawn as one vector per species and the newborns
+        are added in one block
+        """
+        fitness = self.fitness
+        for code, animal_class, rows in self.species_rows():
+            n_animals = self.counts[code, self.cell[rows]]
+            births = animal_class.birth_mask(fitness[rows], self.weight[rows],
+                                             n_animals, self.rng)
+            mothers = rows[births]
+            weights = animal_class.birth_weights(len(mothers), self.rng)
+            xi = animal_class.p['xi']
+            born = xi * weights <= self.weight[mothers]
+            mothers = mothers[born]
+            weights = weights[born]
+            self.set_weight(mothers, self.weight[mothers] - xi * weights)
+            self.add(code, 0, weights, self.cell[mothers])
+
+    def migration_mask(self):
+        """
+        Decides which animals try to migrate this year
+        :return: bool array with one value per animal
+        """
+        fitness = self.fitness
+        moves = np.zeros(self.size, dtype=bool)
+        for code, animal_class, rows in self.species_rows():
+            moves[rows] = animal_class.migration_mask(fitness[rows], self.rng)
+        return moves
+
+    def aging(self):
+        """
+        Every animal gets one year older and loses weight. Only the year is
+        counted, ages and weights are found when they are read. If eta has
+        changed, all weights are first brought up to date with the old value
+        """
+        eta = self._weight_loss()
+        if not np.array_equal(eta, self._eta):
+            self._update_weights(slice(None))
+            self._eta = eta
+        self.year += 1
+        self._herb_weight = None
+
+    def dying(self):
+        """
+        Removes the animals that die this year, decided for the whole island
+        with one vector of random numbers per species
+        """
+        fitness = self.fitness
+        dies = np.zeros(self.size, dtype=bool)
+        for code, animal_class, rows in self.species_rows():
+            dies[rows] = animal_class.death_mask(fitness[rows], self.rng)
+        self.keep(~dies)
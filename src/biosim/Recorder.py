@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
+__email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
+
+from biosim import Fauna as Fa
+import io
+import os
+import numpy as np
+
+
+class Recorder:
+    """
+    Time series of a simulation, one row per recorded year, kept in
+    memory-mapped .npy files in a directory so that long runs on large
+    islands are not held in memory. The files are created with room for
+    capacity years when the first year is recorded, and are grown by
+    doubling and copying when they are full. close() cuts the files down to
+    the recorded years, and load() opens them without copying.
+    The files are:
+    year: (years,) int64
+    totals: (years, 2) int64, herbivores and carnivores on the island
+    counts: (years, 2, rows, cols) int32, animals per species in each cell
+    fodder: (years, rows, cols) float32, fodder left in each cell
+    traits: (years, 2, 3, 1 + len(percentiles)) float64, mean and
+    percentiles of age, weight and fitness per species, nan with no animals
+    :param: names: tuple: the files written
+    """
+    species = (Fa.Herbivore, Fa.Carnivore)
+    traits = ('age', 'weight', 'fitness')
+    names = ('year', 'totals', 'counts', 'fodder', 'traits')
+
+    def __init__(self, directory, capacity=128, percentiles=(5, 50, 95),
+                 cells=True):
+        """
+        :param directory: path of the directory the files are written to
+        :param capacity: int: number of years to allocate room for
+        :param percentiles: tuple: percentiles of the traits to record
+        :param cells: bool, also record counts and fodder of every cell
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be a positive number of years')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.capacity = capacity
+        self.percentiles = tuple(percentiles)
+        self.cells = cells
+        self.length = 0
+        self.arrays = {}
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def path(self, name):
+        """
+        :param name: name of a recorded series
+        :return: str: path of the .npy file of the series
+        """
+        return os.path.join(self.directory, name + '.npy')
+
+    def _create(self, island_map):
+        """
+        Creates the files with room for capacity years
+        :param island_map: Map instance
+        """
+        shape = island_map.landscape.codes.shape
+        n_species = len(self.species)
+        layout = {'year': (np.int64, ()),
+                  'totals': (np.int64, (n_species,)),
+                  'traits': (np.float64, (n_species, len(self.traits),
+                                          1 + len(self.percentiles)))}
+        if self.cells:
+            layout['counts'] = (np.int32, (n_species,) + shape)
+            layout['fodder'] = (np.float32, shape)
+        for name, (dtype, row_shape) in layout.items():
+            self.arrays[name] = np.lib.format.open_memmap(
+                self.path(name), mode='w+', dtype=dtype,
+                shape=(self.capacity,) + row_shape)
+
+    def _grow(self):
+        """
+        Doubles the capacity by copying every series to a new, larger file
+        """
+        capacity = 2 * self.capacity
+        for name in list(self.arrays):
+            old = self.arrays.pop(name)
+            tmp = self.path(name) + '.tmp'
+            new = np.lib.format.open_memmap(
+                tmp, mode='w+', dtype=old.dtype,
+                shape=(capacity,) + old.shape[1:])
+            new[:self.length] = old[:self.length]
+            new.flush()
+            del old, new
+            os.replace(tmp, self.path(name))
+            self.arrays[name] = np.lib.format.open_memmap(self.path(name),
+                                                          mode='r+')
+        self.capacity = capacity
+
+    def summary(self, values):
+        """
+        Mean and percentiles of some values
+        :param values: array
+        :return: array: mean followed by the percentiles, nan if empty
+        """
+        if len(values) == 0:
+            return np.full(1 + len(self.percentiles), np.nan)
+        return np.concatenate(([np.mean(values)],
+                               np.percentile(values, self.percentiles)))
+
+    def record(self, year, island_map):
+        """
+        Appends the state of the island after an annual cycle
+        :param year: int: the simulated year
+        :param island_map: Map instance
+        """
+        if self.closed:
+            raise RuntimeError('The recorder is closed')
+        if not self.arrays:
+            self._create(island_map)
+        if self.length == self.capacity:
+            self._grow()
+        row = self.length
+        self.arrays['year'][row] = year
+        self.arrays['totals'][row] = island_map.totals
+        for s, animal_class in enumerate(self.species):
+            traits = island_map.traits(animal_class)
+            for t, name in enumerate(self.traits):
+                self.arrays['traits'][row, s, t] = self.summary(traits[name])
+        if self.cells:
+            self.arrays['counts'][row] = island_map.census()
+            self.arrays['fodder'][row] = island_map.landscape.fodder.reshape(
+                island_map.landscape.codes.shape)
+        self.length += 1
+
+    def flush(self):
+        """
+        Writes the recorded years to the files
+        """
+        for array in self.arrays.values():
+            array.flush()
+
+    @staticmethod
+    def _cut(path, length):
+        """
+        Lets an .npy file hold only its first rows. The header is written
+        again in place and the file is truncated, or the rows are copied to
+        a new file if the header would change size
+        :param path: path of the .npy file
+        :param length: int: number of rows to keep
+        """
+        with open(path, 'r+b') as f:
+            version = np.lib.format.read_magic(f)
+            read = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                    else np.lib.format.read_array_header_2_0)
+            shape, fortran_order, dtype = read(f)
+            offset = f.tell()
+            header = io.BytesIO()
+            write = (np.lib.format.write_array_header_1_0
+                     if version == (1, 0)
+                     else np.lib.format.write_array_header_2_0)
+            write(header, {'descr': np.lib.format.dtype_to_descr(dtype),
+                           'fortran_order': fortran_order,
+                           'shape': (length,) + shape[1:]})
+            if header.tell() == offset:
+                f.seek(0)
+                f.write(header.getvalue())
+                f.truncate(offset + length * dtype.itemsize *
+                           int(np.prod(shape[1:], dtype=np.int64)))
+                return
+        rows = np.load(path, mmap_mode='r')[:length].copy()
+        np.save(path, rows)
+
+    def close(self):
+        """
+        Flushes the files and cuts them down to the recorded years. Nothing
+        can be recorded after the recorder is closed
+        """
+        names = list(self.arrays)
+        self.flush()
+        self.arrays = {}
+        self.closed = True
+        for name in names:
+            self._cut(self.path(name), self.length)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Opens the series of a closed recorder as read-only memory maps
+        :param directory: path of the directory of the recorder
+        :return: dict: array of every series found
+        """
+        return {name: np.load(os.path.join(directory, name + '.npy'),
+                              mmap_mode='r')
+                for name in cls.names
+                if os.path.exists(os.path.join(directory, name + '.npy'))}
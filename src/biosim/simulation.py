@@ -7,10 +7,7 @@ from biosim import Fauna as Fa
 from biosim import Geography as Geo
 from biosim import Map as Ma
 import random as rd
-import pandas as pd
 import numpy as np
-from matplotlib import colors
-import matplotlib.pyplot as plt
 import textwrap
 import subprocess
 import os
@@ -33,7 +30,8 @@ class BioSim:
             ymax_animals=None,
             cmax_animals=None,
             img_base=None,
-            img_fmt="png"
+            img_fmt="png",
+            columnar=False
     ):
         """
         :param island_map: Multi-line string specifying island geography
@@ -46,10 +44,13 @@ class BioSim:
         :param img_base: String with beginning of file name for figures,
         including path
         :param img_fmt: String with file type for figures, e.g. 'png'
+        :param columnar: Bool, keep the animals in a columnar Population store
+        where deaths, births and migrations are drawn in batches
         """
         rd.seed(seed)
         self.island_map = island_map
-        self.map = Ma.Map(island_map)
+        rng = np.random.default_rng(seed) if columnar else None
+        self.map = Ma.Map(island_map, columnar=columnar, rng=rng)
         self.add_population(ini_pop)
         self._year = 0
 
@@ -60,6 +61,8 @@ class BioSim:
 
         if cmax_animals is None:
             self.cmax_animals = {'Herbivore': 100, 'Carnivore': 50}
+        else:
+            self.cmax_animals = cmax_animals
 
         # For saving images and simulation
         self.img_ctr = 0
@@ -84,6 +87,9 @@ class BioSim:
         self.herbivore_line = None
         self.carnivore_line = None
 
+        # Task putting the end of a run_async run on a full queue
+        self.end_of_run = None
+
     @staticmethod
     def set_animal_parameters(species, params):
         """
@@ -119,10 +125,7 @@ class BioSim:
         Total number of animals on island.
         :return: int
         """
-        num_animals = 0
-        for coord, cell in self.map.island.items():
-            num_animals += cell.total_pop
-        return num_animals
+        return sum(self.map.totals)
 
     @property
     def num_animals_per_species(self):
@@ -130,38 +133,24 @@ class BioSim:
         Number of animals per species in island, as dictionary.
         :return: dict
         """
-        num_animals_per_species = {}
-        herb = 0
-        carn = 0
-        for coord, cell in self.map.island.items():
-            herb += cell.herbivore_pop
-            carn += cell.carnivore_pop
-        num_animals_per_species['Herbivore'] = herb
-        num_animals_per_species['Carnivore'] = carn
-        return num_animals_per_species
+        herb, carn = self.map.totals
+        return {'Herbivore': herb, 'Carnivore': carn}
 
     @property
     def animal_distribution(self):
         """
         Pandas DataFrame with animal count per species for
-        each cell on island.
+        each cell on island, built from the census of the map.
         :return: pd dataframe: 'rows' 'columns' 'Herbivores' 'Carnivores'
         """
-        data = {}
-        rows = []
-        col = []
-        herbs = []
-        carns = []
-        for coord, cell in self.map.island.items():
-            herbs.append(cell.herbivore_pop)
-            carns.append(cell.carnivore_pop)
-            rows.append(coord[0])
-            col.append(coord[1])
-        data['Row'] = rows
-        data['Col'] = col
-        data['Herbivore'] = herbs
-        data['Carnivore'] = carns
-        return pd.DataFrame(data)
+        import pandas as pd
+
+        herbs, carns = self.map.census()
+        rows, cols = np.indices(herbs.shape)
+        return pd.DataFrame({'Row': rows.ravel(),
+                             'Col': cols.ravel(),
+                             'Herbivore': herbs.flatten(),
+                             'Carnivore': carns.flatten()})
 
     def add_population(self, population):
         """
@@ -191,6 +180,9 @@ class BioSim:
         Creates a map plot from string of the island.
         Source: Hans Ekkehard Plesser
         """
+        from matplotlib import colors
+        import matplotlib.pyplot as plt
+
         island_string = self.island_map
         string_map = textwrap.dedent(island_string)
         string_map.replace('\n', ' ')
@@ -262,51 +254,66 @@ class BioSim:
         carn_y[self.year] = n_carn
         self.carnivore_line.set_ydata(carn_y)
 
-    def heat_map_herbivore(self):
+    def heat_map_herbivore(self, counts=None):
         """
-        Creates heat map plot of carnivores on the island
+        Creates heat map plot of herbivores on the island the first time it
+        is called, and only updates the data of the image after that
+        :param counts: 2D array with herbivores per cell, counted from the map
+        if not given
         """
-        herb_cell = self.animal_distribution.pivot('Row', 'Col', 'Herbivore')
-
-        self.herb_density = self.ax_heat_h.imshow(herb_cell,
-                                                  vmax=self.cmax_animals
-                                                  ['Herbivore'],
-                                                  interpolation='nearest',
-                                                  cmap='Greens')
-        self.ax_heat_h.set_title('Herbivore population density')
+        if counts is None:
+            counts = self.map.census()[0]
+        if self.herb_density is None:
+            self.herb_density = self.ax_heat_h.imshow(
+                counts, vmin=0, vmax=self.cmax_animals['Herbivore'],
+                interpolation='nearest', cmap='Greens')
+            self.ax_heat_h.set_title('Herbivore population density')
+        else:
+            self.herb_density.set_data(counts)
 
-    def heat_map_carnivore(self):
+    def heat_map_carnivore(self, counts=None):
         """
-        Creates heat map plot of carnivores on the island
+        Creates heat map plot of carnivores on the island the first time it
+        is called, and only updates the data of the image after that
+        :param counts: 2D array with carnivores per cell, counted from the map
+        if not given
         """
-        carn_cell = self.animal_distribution.pivot('Row', 'Col', 'Carnivore')
-
-        self.herb_density = self.ax_heat_c.imshow(carn_cell,
-                                                  vmax=self.cmax_animals
-                                                  ['Carnivore'],
-                                                  interpolation='nearest',
-                                                  cmap='Reds')
-        self.ax_heat_c.set_title('Carnivore population density')
+        if counts is None:
+            counts = self.map.census()[1]
+        if self.carn_density is None:
+            self.carn_density = self.ax_heat_c.imshow(
+                counts, vmin=0, vmax=self.cmax_animals['Carnivore'],
+                interpolation='nearest', cmap='Reds')
+            self.ax_heat_c.set_title('Carnivore population density')
+        else:
+            self.carn_density.set_data(counts)
 
     def update_all(self):
         """
         Updates plots for simulation
         """
-        self.heat_map_carnivore()
-        self.heat_map_herbivore()
+        import matplotlib.pyplot as plt
+
+        herb_counts, carn_counts = self.map.census()
+        self.heat_map_carnivore(carn_counts)
+        self.heat_map_herbivore(herb_counts)
         self.update_population_plot()
         self.ax_year.set_text(f'Year: {self.year}')
         self.ax_animal_count.set_text(f'Pop: {self.num_animals}')
 
         plt.pause(1e-6)
 
-    def simulate(self, num_years, vis_years=1, img_years=None):
+    def simulate(self, num_years, vis_years=1, img_years=None,
+                 recorder=None):
         """
         Runs simulation while visualizing the result. saves image files
         :param num_years: number of years to simulate
-        :param vis_years: years between visualization updates
+        :param vis_years: years between visualization updates, None runs the
+        simulation headless without creating or drawing any figures
         :param img_years: years between visualizations saved to files (default:
-        vis_years)
+        vis_years), not used when running headless
+        :param recorder: Recorder that every simulated year is appended to,
+        it is left open so that later simulations can be recorded too
 
         Image files will be numbered consecutively.
         """
@@ -314,6 +321,14 @@ class BioSim:
             img_years = vis_years
 
         self.final_year = self._year + num_years
+        if vis_years is None:
+            while self._year < self.final_year:
+                self._year += 1
+                self.map.annual_cycle()
+                if recorder is not None:
+                    recorder.record(self._year, self.map)
+            return
+
         self.setup_graphics()
 
         while self._year < self.final_year:
@@ -325,12 +340,122 @@ class BioSim:
                 self.save_graphic()
             self._year += 1
             self.map.annual_cycle()
+            if recorder is not None:
+                recorder.record(self._year, self.map)
+
+    def snapshot(self, traits=False):
+        """
+        State of the island in the current year, without any plotting
+        :param traits: bool, also summarize age, weight and fitness per
+        species
+        :return: dict: 'year', 'totals' with the number of animals per
+        species, 'counts' with read-only (rows, cols) arrays of animals per
+        cell for each species, and with traits=True 'traits' with the mean
+        age, weight and fitness per species (nan with no animals)
+        """
+        herbs, carns = self.map.census()
+        snapshot = {'year': self.year,
+                    'totals': self.num_animals_per_species,
+                    'counts': {'Herbivore': herbs, 'Carnivore': carns}}
+        if traits:
+            snapshot['traits'] = {}
+            for species, animal_class in (('Herbivore', Fa.Herbivore),
+                                          ('Carnivore', Fa.Carnivore)):
+                snapshot['traits'][species] = {
+                    name: float(values.mean()) if len(values) else np.nan
+                    for name, values in self.map.traits(animal_class).items()
+                }
+        return snapshot
+
+    def iter_years(self, num_years, every=1, traits=False):
+        """
+        Runs the simulation headless and yields a snapshot of the island
+        every few years. Nothing is kept between the snapshots, so the
+        snapshots can be processed as a stream
+        :param num_years: number of years to simulate
+        :param every: years between snapshots
+        :param traits: bool, include age, weight and fitness summaries
+        :return: generator of snapshot dicts, see snapshot
+        """
+        if every < 1:
+            raise ValueError('every must be a positive number of years')
+        self.final_year = self._year + num_years
+        while self._year < self.final_year:
+            snapshot = self._advance(every, traits)
+            if snapshot is not None:
+                yield snapshot
+
+    def _advance(self, every, traits):
+        """
+        Simulates one year and takes a snapshot if one is due
+        :param every: years between snapshots
+        :param traits: bool, include age, weight and fitness summaries
+        :return: snapshot dict if a snapshot is due this year, else None
+        """
+        self._year += 1
+        self.map.annual_cycle()
+        if self._year % every == 0:
+            return self.snapshot(traits)
+        return None
+
+    async def run_async(self, num_years, queue=None, every=1, traits=False,
+                        deadline=None, executor=None):
+        """
+        Runs the simulation headless without blocking the event loop. Each
+        annual cycle runs in a worker thread, and the loop is free between
+        and during the years. If the task is cancelled, the year in progress
+        is finished before the cancellation is passed on, so the simulation
+        can be continued later
+        :param num_years: number of years to simulate
+        :param queue: asyncio.Queue the snapshots are put in, followed by None
+        when the run ends, also if it is cancelled or fails, None to not
+        publish snapshots. If a bounded queue is full when the run ends, the
+        None is put by the task kept in end_of_run once the queue is drained,
+        and the loop must keep running until that task is done
+        :param every: years between snapshots
+        :param traits: bool, include age, weight and fitness summaries
+        :param deadline: seconds after which no new year is started, None
+        runs all the years
+        :param executor: concurrent.futures executor for the annual cycles,
+        the default executor of the loop if None
+        :return: int: the year the run stopped in
+        """
+        import asyncio
+
+        if every < 1:
+            raise ValueError('every must be a positive number of years')
+        loop = asyncio.get_running_loop()
+        stop_time = None if deadline is None else loop.time() + deadline
+        self.final_year = self._year + num_years
+        self.end_of_run = None
+        try:
+            while self._year < self.final_year:
+                if stop_time is not None and loop.time() >= stop_time:
+                    break
+                future = loop.run_in_executor(executor, self._advance, every,
+                                              traits)
+                try:
+                    snapshot = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    await asyncio.wait([future])
+                    raise
+                if snapshot is not None and queue is not None:
+                    await queue.put(snapshot)
+        finally:
+            if queue is not None:
+                try:
+                    queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    self.end_of_run = loop.create_task(queue.put(None))
+        return self._year
 
     def setup_graphics(self):
         """
         Sets up figure graphic for plotting each subplot simulation
         instantiated in the simulation method
         """
+        import matplotlib.pyplot as plt
+
         if self.fig is None:
             self.fig = plt.figure()
             self.fig.suptitle('Simulation of Rossumøya', fontsize=16)
@@ -371,6 +496,7 @@ class BioSim:
         if self.img_base is None:
             return
 
+        import matplotlib.pyplot as plt
         plt.savefig('{base}_{num:05d}.{type}'.format(base=self.img_base,
                                                      num=self.img_ctr,
                                                      type=self.img_fmt))
@@ -402,6 +528,8 @@ class BioSim:
 
 
 if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
     plt.ion()
     geogr = """\
                OOOOOOOOOOOOOOOOOOOOO
@@ -4,6 +4,7 @@ __author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
 __email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
 
 from biosim import Fauna as Fa
+import numpy as np
 import random as rd
 import pytest
 
@@ -137,6 +138,86 @@ class TestFauna:
         assert herb2.check_birth(100) is False
         assert carn.check_birth(6) is True
 
+    def test_fitness_vector(self):
+        """
+        Tests that the vectorized fitness equals the fitness of each animal
+        and is zero for animals without weight
+        """
+        herbs = [Fa.Herbivore(age=a, weight=w)
+                 for a, w in [(0, 8), (40, 10), (80, 50), (3, 0)]]
+        fitness = Fa.Herbivore.fitness_vector([h.age for h in herbs],
+                                              [h.weight for h in herbs])
+        assert fitness == pytest.approx([h.fitness for h in herbs])
+        assert fitness[-1] == 0
+
+    def test_fitness_cache(self):
+        """
+        Tests that cached fitness is updated when weight, age or parameters
+        change, and that fitness_array fills the cache
+        """
+        herb = Fa.Herbivore(age=10, weight=20)
+        carn = Fa.Carnivore(age=10, weight=20)
+        fitness = Fa.BaseFauna.fitness_array([herb, carn])
+        assert herb._fitness == fitness[0] and carn._fitness == fitness[1]
+        a = herb.fitness
+        herb.weight = 40
+        assert herb.fitness > a
+        b = herb.fitness
+        herb.age = 60
+        assert herb.fitness < b
+        c = herb.fitness
+        Fa.Herbivore.set_parameter({'a_half': 80.0})
+        assert herb.fitness > c
+        Fa.Herbivore.set_parameter({'a_half': 40.0})
+        assert herb.fitness == c
+
+    def test_birth_weights(self):
+        """
+        Tests that birth weights are drawn in one call from the normal
+        distribution of the species
+        """
+        weights = Fa.Carnivore.birth_weights(10000,
+                                             np.random.default_rng(1))
+        assert len(weights) == 10000
+        assert weights.mean() == pytest.approx(6.0, abs=0.05)
+        assert weights.std() == pytest.approx(1.0, abs=0.05)
+        assert len(Fa.Herbivore.birth_weights(0)) == 0
+
+    def test_death_mask(self):
+        """
+        Tests that animals without fitness always die, and that the share of
+        deaths follows omega * (1 - fitness)
+        """
+        rng = np.random.default_rng(1)
+        dies = Fa.Herbivore.death_mask(np.zeros(10), rng)
+        assert dies.all()
+        dies = Fa.Herbivore.death_mask(np.full(10000, 0.5), rng)
+        assert dies.mean() == pytest.approx(0.2, abs=0.02)
+        assert not Fa.Herbivore.death_mask(np.ones(10), rng).any()
+
+    def test_birth_mask(self):
+        """
+        Tests that light animals and animals alone in the cell never give
+        birth, and that heavy fit animals with many partners always do
+        """
+        rng = np.random.default_rng(1)
+        fitness = np.ones(4)
+        weight = np.array([33.24, 60, 60, 60])
+        births = Fa.Herbivore.birth_mask(fitness, weight, 10, rng)
+        assert list(births) == [False, True, True, True]
+        births = Fa.Herbivore.birth_mask(fitness, weight,
+                                         np.array([10, 1, 10, 1]), rng)
+        assert list(births) == [False, False, True, False]
+
+    def test_migration_mask(self):
+        """
+        Tests that the share of migrating animals follows mu * fitness
+        """
+        rng = np.random.default_rng(1)
+        moves = Fa.Carnivore.migration_mask(np.full(10000, 0.5), rng)
+        assert moves.mean() == pytest.approx(0.2, abs=0.02)
+        assert not Fa.Carnivore.migration_mask(np.zeros(10), rng).any()
+
     def test_herbivore_eat(self):
         """
         Test that weight increases with 9 when appetite*beta = 9
@@ -188,6 +269,48 @@ class TestFauna:
         assert len(herbs2) == 95
         assert c.weight == 113.5
 
+    def test_carnivore_hunt(self):
+        """
+        Tests that hunt marks kills in the mask without touching the list and
+        stops at the first herbivore at least as fit as the carnivore
+        """
+        Fa.Carnivore.set_parameter({'DeltaPhiMax': 0.5})
+        c = Fa.Carnivore(age=5, weight=5)
+        herbs = [Fa.Herbivore(age=5, weight=80), Fa.Herbivore(weight=0),
+                 Fa.Herbivore(weight=0)]
+        killed = [False, False, True]
+        rd.seed(1)
+        c.hunt(herbs, killed)
+        assert killed == [False, True, True]
+        assert len(herbs) == 3
+        assert c.weight == 5
+
+    def test_carnivore_predation(self):
+        """
+        Tests the array predation engine: certain kills when the fitness
+        difference exceeds DeltaPhiMax, no kills of fitter prey, killed prey
+        are skipped and the carnivore stops when its appetite is full
+        """
+        rng = np.random.default_rng(1)
+        Fa.Carnivore.set_parameter({'DeltaPhiMax': 0.1})
+        prey_fitness = np.array([0.0, 0.0, 0.0, 0.99])
+        prey_weight = np.array([20., 20., 20., 20.])
+        killed = np.array([False, True, False, False])
+        weight = Fa.Carnivore.predation(5, 40., prey_fitness, prey_weight,
+                                        killed, rng)
+        assert list(killed) == [True, True, True, False]
+        assert weight == 40 + 2 * 20 * 0.75
+        killed = np.zeros(4, dtype=bool)
+        Fa.Carnivore.set_parameter({'F': 70.0})
+        weight = Fa.Carnivore.predation(5, 40., np.zeros(4), prey_weight,
+                                        killed, rng)
+        assert killed.sum() == 4
+        assert weight == 40 + 3 * 20 * 0.75 + 10 * 0.75
+        killed = np.zeros(1, dtype=bool)
+        assert Fa.Carnivore.predation(5, 40., np.array([0.99]),
+                                      np.array([20.]), killed, rng) == 40
+        assert not killed.any()
+
     def test_set_parameter(self):
         """
         Tests that new parameters can be set with method
@@ -202,3 +325,12 @@ class TestFauna:
         assert h.p['F'] == 15
         reset = {'w_birth': 8, 'sigma_birth': 1.5, 'F': 10}
         Fa.Herbivore.set_parameter(reset)
+
+    def test_herbivore_portions(self):
+        """
+        Tests that herbivores eat F each until the fodder is gone, for one
+        cell and for several cells at once
+        """
+        assert list(Fa.Herbivore.portions(25, 4)) == [10, 10, 5, 0]
+        eaten = Fa.Herbivore.portions([5, 0, 100], [2, 0, 1])
+        assert list(eaten) == [5, 0, 10]
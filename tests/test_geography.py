@@ -6,6 +6,7 @@ __email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
 from biosim import Geography as Geo
 from biosim import Fauna as Fa
 
+import numpy as np
 import random as rd
 import pytest
 
@@ -128,6 +129,20 @@ class TestGeography:
         assert len(jung.pop_carnivores) == 0
         assert a == jung.pop_herbivores[0]
 
+    def test_animal_die_batched(self):
+        """
+        Tests that the batched death check removes animals without weight
+        and keeps the survivors in order
+        """
+        jung = Geo.Jungle()
+        herbs = [Fa.Herbivore(weight=0), Fa.Herbivore(age=5, weight=50),
+                 Fa.Herbivore(weight=0), Fa.Herbivore(age=5, weight=60)]
+        jung.populate_cell(herbs)
+        jung.populate_cell([Fa.Carnivore(weight=0)])
+        jung.animals_die(np.random.default_rng(3))
+        assert jung.pop_herbivores == [herbs[1], herbs[3]]
+        assert jung.carnivore_pop == 0
+
     def test_pop_methods(self):
         """
         Test if the population methods return the correct amount of animals in
@@ -191,6 +206,23 @@ class TestGeography:
         assert s.propensity_carn() == 1
         assert m.propensity_carn() == 0 and o.propensity_carn() == 0
 
+    def test_propensity_vector(self):
+        """
+        Tests that the vectorized propensity equals the propensity of each
+        cell
+        """
+        j = Geo.Jungle()
+        j.populate_cell([Fa.Herbivore(weight=10) for _ in range(5)])
+        s = Geo.Savannah()
+        m = Geo.Mountain()
+        cells = [j, s, m]
+        herb = Geo.BaseGeography.propensity_vector(
+            Fa.Herbivore, [800, 300, 0], [5, 0, 0], [True, True, False])
+        carn = Geo.BaseGeography.propensity_vector(
+            Fa.Carnivore, [50, 0, 0], [0, 0, 0], [True, True, False])
+        assert herb == pytest.approx([c.propensity_herb() for c in cells])
+        assert carn == pytest.approx([c.propensity_carn() for c in cells])
+
     def test_check_migration(self):
         """
         Test if method returns a list with animals ready to migrate and that
@@ -211,6 +243,19 @@ class TestGeography:
         assert isinstance(a, list)
         assert len(b) == 1
 
+    def test_check_migration_batched(self):
+        """
+        Tests that batched migration checks return a share of the animals
+        close to their probability of moving
+        """
+        s = Geo.Savannah()
+        carns = [Fa.Carnivore(age=5, weight=50) for _ in range(1000)]
+        s.populate_cell(carns)
+        moving = s.check_migration(np.random.default_rng(2))
+        prob_move = Fa.Carnivore.p['mu'] * carns[0].fitness
+        assert len(moving) == pytest.approx(1000 * prob_move, abs=60)
+        assert all(carn in carns for carn in moving)
+
     def test_fodder_eaten(self):
         """
         Tests that method returns fodder and fodder eaten when there's
@@ -263,6 +308,38 @@ class TestGeography:
         d.populate_cell([Fa.Herbivore(weight=10) for _ in range(10)])
         assert d.get_herb_weight() == 100
 
+    def test_herb_weight_kept_up_to_date(self):
+        """
+        Tests that the combined herbivore weight follows eating, predation,
+        mating, weight loss and death of the animals in the cell
+        """
+        j = Geo.Jungle()
+        j.populate_cell([Fa.Herbivore(age=5, weight=40) for _ in range(20)])
+        j.populate_cell([Fa.Carnivore(age=5, weight=30) for _ in range(3)])
+        rng = np.random.default_rng(8)
+        rd.seed(8)
+        for _ in range(3):
+            j.fodder_growth()
+            j.herbivore_eat()
+            j.carnivore_eat()
+            j.animal_mating(rng)
+            j.age_weightloss()
+            j.animals_die(rng)
+            herb_weight = sum(herb.weight for herb in j.pop_herbivores)
+            assert j.get_herb_weight() == pytest.approx(herb_weight)
+        j.remove_animals(list(j.pop_herbivores))
+        assert j.get_herb_weight() == 0
+
+    def test_animals(self):
+        """
+        Tests that animals iterates over both species
+        """
+        j = Geo.Jungle()
+        herb = Fa.Herbivore()
+        carn = Fa.Carnivore()
+        j.populate_cell([herb, carn])
+        assert list(j.animals()) == [carn, herb]
+
     def test_animal_mating(self):
         """
         Tests that babies born is an instance of its species
@@ -280,6 +357,32 @@ class TestGeography:
         assert len(j.pop_carnivores) == 9
         assert isinstance(j.pop_carnivores[-1], Fa.Carnivore)
 
+    def test_animal_mating_batched(self):
+        """
+        Tests that batched birth checks give the same births as the per
+        animal checks when the birth probability is 0 or 1
+        """
+        j = Geo.Jungle()
+        j.populate_cell([Fa.Herbivore(age=1, weight=100),
+                         Fa.Carnivore(age=1, weight=100)])
+        j.populate_cell([Fa.Herbivore(age=10, weight=10) for _ in range(7)])
+        j.populate_cell([Fa.Carnivore(age=60, weight=10) for _ in range(7)])
+        j.animal_mating(np.random.default_rng(4))
+        assert j.herbivore_pop == 9 and j.carnivore_pop == 9
+        assert j.pop_herbivores[0].weight < 100
+
+    def test_animal_mating_too_light(self):
+        """
+        Tests that no newborn is created and the mother keeps her weight when
+        the newborn is too heavy for her
+        """
+        j = Geo.Jungle()
+        j.populate_cell([Fa.Herbivore(age=1, weight=35) for _ in range(2)])
+        Fa.Herbivore.set_parameter({'xi': 10})
+        j.animal_mating(np.random.default_rng(5))
+        assert j.herbivore_pop == 2
+        assert all(herb.weight == 35 for herb in j.pop_herbivores)
+
     def test_age_weightloss(self):
         """
         Tests age and weightloss is updated after calling function
@@ -370,3 +473,25 @@ class TestGeography:
         assert jung.geo_p['f_max'] == 1000
         assert jung.fodder == 1000
         Geo.Jungle.set_parameter({'f_max': 800, 'alpha': 300})
+
+    def test_landscape_lazy_growth(self):
+        """
+        Tests that the fodder of a landscape is found in closed form when it
+        is read, and that a parameter change only affects the years after it
+        """
+        land = Geo.Landscape([[3, 4]])
+        savannah, jungle = land.cell(0), land.cell(1)
+        savannah.fodder = 100
+        jungle.fodder = 10
+        assert jungle.fodder == 10
+        for _ in range(3):
+            land.fodder_growth()
+        assert land.updated[0] == 0
+        assert savannah.fodder == pytest.approx(300 - 200 * 0.7 ** 3)
+        assert jungle.fodder == 800
+        savannah.fodder = 100
+        land.fodder_growth()
+        Geo.Savannah.set_parameter({'alpha': 0.5})
+        land.fodder_growth()
+        assert land.fodder[0] == pytest.approx(300 - 200 * 0.7 * 0.5)
+        Geo.Savannah.set_parameter({'alpha': 0.3})
@@ -5,6 +5,8 @@ __email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
 
 from biosim import Map as Ma
 from biosim import Fauna as Fa
+from biosim import Geography as Geo
+import numpy as np
 import random as rd
 import pytest
 
@@ -48,6 +50,105 @@ class TestMap:
         with pytest.raises(ValueError):
             Ma.Map(map4)
 
+    def test_parse(self):
+        """
+        Tests that a map string is parsed into a grid of landscape codes and
+        that bad maps raise ValueErrors
+        """
+        codes = Ma.Map.parse("""\
+                             OOOO
+                             OJSO
+                             OMDO
+                             OOOO""")
+        assert codes.shape == (4, 4)
+        assert ''.join(Geo.Landscape.letters[c] for c in codes[1:3, 1:3].flat
+                       ) == 'JSMD'
+        for bad in ["OOO\nOJO\nOOO\n", "OOO\nOÆO\nOOO", "",
+                    "OOO\nOJO\nOOJ"]:
+            with pytest.raises(ValueError):
+                Ma.Map.parse(bad)
+
+    def test_lazy_island(self):
+        """
+        Tests that cells are only created when they are looked up and that
+        the island works as a dictionary of positions
+        """
+        m = Ma.Map("OOOO\nOJSO\nOOOO")
+        assert len(m.cells._cells) == 0
+        assert isinstance(m.island[1, 2], Geo.Savannah)
+        assert m.island[1, 2] is m.cells[m.cell_index[1, 2]]
+        assert len(m.cells._cells) == 1
+        assert len(m.island) == 12 and list(m.island)[5] == (1, 1)
+        assert (-1, 1) not in m.island and (3, 0) not in m.island
+        with pytest.raises(KeyError):
+            m.island[1, 4]
+
+    def test_count_grid(self):
+        """
+        Tests that the animals of each species are counted in the position of
+        their cell, in both engines
+        """
+        for columnar in (False, True):
+            m = Ma.Map("OOOO\nOJSO\nOOOO", columnar=columnar)
+            m.populate_map((1, 2), [Fa.Herbivore(), Fa.Herbivore(),
+                                    Fa.Carnivore()])
+            grid = m.count_grid()
+            assert grid.shape == (2, 3, 4)
+            assert grid[:, 1, 2].tolist() == [2, 1]
+            assert grid.sum() == 3
+
+    def test_census(self):
+        """
+        Tests that the census is kept within a year and counted again after
+        animals are placed or a year has passed
+        """
+        m = Ma.Map("OOOO\nOJSO\nOOOO")
+        m.populate_map((1, 1), [Fa.Herbivore(weight=20) for _ in range(5)])
+        herbs, carns = m.census()
+        assert m.census()[0] is herbs
+        assert herbs[1, 1] == 5 and carns.sum() == 0
+        with pytest.raises(ValueError):
+            herbs[1, 1] = 0
+        m.populate_map((1, 2), [Fa.Carnivore()])
+        assert m.census()[1][1, 2] == 1
+        m.annual_cycle()
+        assert m.census()[0].sum() == m.island[1, 1].herbivore_pop + \
+            m.island[1, 2].herbivore_pop
+
+    def test_totals(self):
+        """
+        Tests that the island totals follow births, kills, deaths and
+        migration in both engines
+        """
+        for columnar in (False, True):
+            m = Ma.Map("OOOOO\nOJJSO\nOOOOO", columnar=columnar,
+                       rng=np.random.default_rng(4))
+            m.populate_map((1, 1), [Fa.Herbivore(age=5, weight=20)
+                                    for _ in range(40)])
+            m.populate_map((1, 2), [Fa.Carnivore(age=5, weight=20)
+                                    for _ in range(10)])
+            assert m.totals == (40, 10)
+            for _ in range(10):
+                m.annual_cycle()
+                herbs, carns = m.census()
+                assert m.totals == (herbs.sum(), carns.sum())
+
+    def test_traits(self):
+        """
+        Tests that age, weight and fitness are collected per species in both
+        engines
+        """
+        for columnar in (False, True):
+            m = Ma.Map("OOOO\nOJSO\nOOOO", columnar=columnar)
+            m.populate_map((1, 1), [Fa.Herbivore(age=2, weight=10),
+                                    Fa.Carnivore(age=3, weight=20)])
+            m.populate_map((1, 2), [Fa.Herbivore(age=4, weight=30)])
+            herbs = m.traits(Fa.Herbivore)
+            assert sorted(herbs['age']) == [2, 4]
+            assert sorted(herbs['weight']) == [10, 30]
+            assert list(m.traits(Fa.Carnivore)['fitness']) == \
+                [pytest.approx(Fa.Carnivore(age=3, weight=20).fitness)]
+
     def test_check_input_in_sim(self):
         """
         Inputs for position in simulation cant be Mountain, Ocean or out of
@@ -155,6 +256,22 @@ class TestMap:
         assert m.island[1, 2].total_pop == 62
         assert m.island[new_cell].total_pop == 48
 
+    def test_move_once(self):
+        """
+        Tests that an animal that moves into a cell is not moved again from
+        that cell in the same year, and that the movers leave the old cell
+        """
+        mu = Fa.Herbivore.p['mu']
+        Fa.Herbivore.set_parameter({'mu': 100.0})
+        m = Ma.Map("OOOO\nOJJO\nOOOO")
+        m.populate_map((1, 1), [Fa.Herbivore(
+            age=5, weight=30) for _ in range(10)])
+        m.move()
+        Fa.Herbivore.set_parameter({'mu': mu})
+        assert m.island[1, 1].herbivore_pop == 0
+        assert m.island[1, 2].herbivore_pop == 10
+        assert m.island[1, 1].get_herb_weight() == 0
+
     def test_annual_cycle(self):
         """
         Tests that annual cycle works as it should
@@ -170,3 +287,172 @@ class TestMap:
             age=15, weight=30) for _ in range(5)])
         for _ in range(10):
             m.annual_cycle()
+
+    def test_columnar_active_cells(self):
+        """
+        Tests that the columnar engine finds the occupied cells from the
+        store without keeping a set of active cells
+        """
+        m = Ma.Map("OOOOO\nOJSMO\nOOOOO", columnar=True,
+                   rng=np.random.default_rng(2))
+        m.populate_map((1, 2), [Fa.Herbivore(
+            age=5, weight=30) for _ in range(40)])
+        assert m.active_cells() == [m.cell_index[1, 2]]
+        for _ in range(3):
+            m.annual_cycle()
+        assert m.active == set()
+        assert m.active_cells() == sorted(
+            set(m.population.cell.tolist()))
+
+    def test_active_cells(self):
+        """
+        Tests that only cells with animals are active, that emptied cells are
+        dropped and that fodder still grows in cells that are not active
+        """
+        m = Ma.Map("OOOOO\nOJSMO\nOOOOO")
+        assert m.active_cells() == []
+        m.populate_map((1, 2), [Fa.Herbivore(
+            age=5, weight=30) for _ in range(40)])
+        assert m.active_cells() == [m.cell_index[1, 2]]
+        m.annual_cycle()
+        assert m.cell_index[1, 2] in m.active
+        for cell in m.cells:
+            cell.remove_animals(list(cell.animals()))
+        m.update_active()
+        assert m.active == set()
+        fodder = m.island[1, 2].fodder
+        Geo.Jungle.set_parameter({'f_max': 700})
+        m.annual_cycle()
+        Geo.Jungle.set_parameter({'f_max': 800})
+        assert m.island[1, 1].fodder == 700
+        assert m.island[1, 2].fodder == fodder + 0.3 * (300 - fodder)
+
+    def test_landscape(self):
+        """
+        Tests that the map keeps landscape codes and fodder in a Landscape
+        and that the cells read their fodder from it
+        """
+        m = Ma.Map("OOOO\nOJSO\nOMDO\nOOOO")
+        assert m.landscape.codes.shape == (4, 4)
+        assert m.landscape.codes[1, 1] == Geo.Landscape.letters.index('J')
+        assert isinstance(m.island[2, 1], Geo.Mountain)
+        m.island[1, 2].fodder = 100
+        assert m.landscape.fodder[m.cell_index[1, 2]] == 100
+        m.landscape.fodder_growth()
+        assert m.island[1, 2].fodder == 160
+        assert m.island[1, 1].fodder == 800
+        assert m.island[2, 2].fodder == 0
+
+    def test_columnar_map(self):
+        """
+        Tests that a columnar map keeps the animals in the population store
+        and runs the annual cycle on it
+        """
+        map1 = """\
+                 OOOOO
+                 OJJJO
+                 OOOOO"""
+        m = Ma.Map(map1, columnar=True)
+        m.populate_map((1, 2), [Fa.Carnivore(
+            age=10, weight=50) for _ in range(10)])
+        m.populate_map((1, 2), [Fa.Herbivore(
+            age=15, weight=30) for _ in range(50)])
+        assert len(m.population) == 60
+        assert m.island[1, 2].herbivore_pop == 50
+        rd.seed(1)
+        for _ in range(5):
+            m.annual_cycle()
+        assert sum(cell.total_pop for cell in m.cells) == len(m.population)
+
+    def test_batched_annual_cycle(self):
+        """
+        Tests that both map types run with batched decisions from a numpy
+        Generator and keep the animals on land
+        """
+        map1 = """\
+                 OOOOO
+                 OJJSO
+                 OOOOO"""
+        for columnar in (False, True):
+            m = Ma.Map(map1, columnar=columnar,
+                       rng=np.random.default_rng(7))
+            m.populate_map((1, 2), [Fa.Herbivore(
+                age=5, weight=30) for _ in range(50)])
+            for _ in range(5):
+                m.annual_cycle()
+            assert sum(cell.herbivore_pop for cell in m.cells) > 0
+            assert all(cell.total_pop == 0 for cell in m.cells
+                       if not cell.animals_here)
+
+    def test_migration_table(self):
+        """
+        Tests that the migration table gives cumulative probabilities that
+        end in one, never leads into ocean or mountain, and can be looked up
+        by position or by cell index
+        """
+        map1 = """\
+                 OOOOO
+                 OJJMO
+                 OOOOO"""
+        m = Ma.Map(map1)
+        table = m.migration_table((1, 2), Fa.Herbivore)
+        assert table[-1] == pytest.approx(1)
+        assert table[0] == 0 and table[1] == 0
+        assert table[2] == table[1]
+        assert m.migration_table((1, 1), Fa.Carnivore) == [0, 0, 1, 1]
+        assert m.table(m.cell_index[1, 2], Fa.Herbivore) == table
+        rd.seed(3)
+        assert m.migrate_to((1, 2), Fa.Herbivore()) == (1, 1)
+
+    def test_neighbour_index(self):
+        """
+        Tests that the dense neighbour index matches find_neighbor_cells, with
+        neighbours outside the map replaced by the cell itself
+        """
+        m = Ma.Map("OOOO\nOJSO\nOOOO")
+        assert m.neighbours.shape == (12, 4)
+        for index, loc in enumerate(m.coordinates):
+            expected = [m.cell_index.get(pos, index)
+                        for pos in m.find_neighbor_cells(loc)]
+            assert list(m.neighbours[index]) == expected
+        assert list(m.passable) == [False] * 5 + [True] * 2 + [False] * 5
+
+    def test_destinations(self):
+        """
+        Tests that destinations follow the migration tables: animals only
+        move to land neighbours, animals with no land neighbour stay, and a
+        random number picks the neighbour like migrate_to does
+        """
+        map1 = """\
+                 OOOOO
+                 OJJMO
+                 OOOOO"""
+        m = Ma.Map(map1, columnar=True)
+        tables = m.migration_tables()
+        j1 = m.cell_index[1, 1]
+        j2 = m.cell_index[1, 2]
+        assert tables[0, j1] == pytest.approx([0, 0, 1, 1])
+        assert np.isnan(tables[0, 0]).all()
+        cells = np.array([j1, j1, j2, 0])
+        new_cells = m.destinations(tables, cells, np.array([0, 1, 0, 1]),
+                                   np.array([0.1, 0.9, 0.5, 0.5]))
+        assert list(new_cells) == [j2, j2, j1, 0]
+
+    def test_move_population(self):
+        """
+        Tests that migration in the columnar map keeps every animal and only
+        moves animals between neighbouring land cells
+        """
+        map1 = """\
+                 OOOOOO
+                 OJJJJO
+                 OJMJJO
+                 OOOOOO"""
+        m = Ma.Map(map1, columnar=True, rng=np.random.default_rng(4))
+        m.populate_map((1, 2), [Fa.Herbivore(
+            age=5, weight=30) for _ in range(500)])
+        m.move()
+        assert len(m.population) == 500
+        assert m.island[1, 2].herbivore_pop < 500
+        occupied = {m.coordinates[c] for c in m.population.cell}
+        assert occupied <= {(1, 1), (1, 2), (1, 3)}
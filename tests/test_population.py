@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
+__email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
+
+from biosim import Population as Po
+from biosim import Geography as Geo
+from biosim import Fauna as Fa
+import numpy as np
+import pytest
+
+
+class TestPopulation:
+    """
+    Tests for the columnar Population store
+    """
+    @pytest.fixture(autouse=True)
+    def setup_teardown(self):
+        p = {
+            "w_birth": 8.0,
+            "sigma_birth": 1.5,
+            "beta": 0.9,
+            "eta": 0.05,
+            "a_half": 40.0,
+            "phi_age": 0.2,
+            "w_half": 10.0,
+            "phi_weight": 0.1,
+            "mu": 0.25,
+            "landa": 1.0,
+            "gamma": 0.2,
+            "zeta": 3.5,
+            "xi": 1.2,
+            "omega": 0.4,
+            "F": 10.0,
+        }
+        f = {
+            "w_birth": 6.0,
+            "sigma_birth": 1.0,
+            "beta": 0.75,
+            "eta": 0.125,
+            "a_half": 60.0,
+            "phi_age": 0.4,
+            "w_half": 4.0,
+            "phi_weight": 0.4,
+            "mu": 0.4,
+            "landa": 1.0,
+            "gamma": 0.8,
+            "zeta": 3.5,
+            "xi": 1.1,
+            "omega": 0.9,
+            "F": 50.0,
+            "DeltaPhiMax": 10.0
+        }
+        Fa.Carnivore.set_parameter(f)
+        Fa.Herbivore.set_parameter(p)
+        Geo.Jungle.set_parameter({'f_max': 800})
+        yield
+
+    def test_add_animals(self):
+        """
+        Tests that animals are copied into the store and counted per cell,
+        and that objects that are not animals are ignored
+        """
+        pop = Po.Population(n_cells=3, capacity=2)
+        pop.add_animals([Fa.Herbivore(age=3, weight=10), Fa.Carnivore(),
+                         None, Fa.Herbivore(age=1, weight=5)], 1)
+        assert len(pop) == 3
+        assert list(pop.age[[0, 2]]) == [3, 1]
+        assert pop.count(1, Fa.Herbivore) == 2
+        assert pop.count(1, Fa.Carnivore) == 1
+        assert pop.count(0) == 0
+        assert pop.count() == 3
+
+    def test_capacity(self):
+        """
+        Tests that the store grows past its capacity and that it needs room
+        for at least one animal
+        """
+        pop = Po.Population(n_cells=1, capacity=1)
+        pop.add(0, 1, np.full(5, 10.), 0)
+        assert len(pop) == 5
+        with pytest.raises(ValueError):
+            Po.Population(n_cells=1, capacity=0)
+
+    def test_view(self):
+        """
+        Tests that a view reads and writes the row of the store
+        """
+        pop = Po.Population(n_cells=1)
+        pop.add(0, 5, 20.0, 0)
+        herb = pop.view(0)
+        assert isinstance(herb, Fa.Herbivore)
+        assert herb.age == 5 and herb.weight == 20
+        herb.eat(10)
+        assert pop.weight[0] == 29
+        assert herb.fitness == pytest.approx(
+            Fa.Herbivore(age=5, weight=29).fitness)
+
+    def test_fitness_cache(self):
+        """
+        Tests that only the rows with changed weight get new fitness
+        """
+        pop = Po.Population(n_cells=1)
+        pop.add(np.array([0, 1]), 10, np.array([10., 10.]), 0)
+        fitness = pop.fitness.copy()
+        assert fitness[0] == pytest.approx(
+            Fa.Herbivore(age=10, weight=10).fitness)
+        pop.set_weight(np.array([1]), 20.)
+        assert pop.fitness[0] == fitness[0]
+        assert pop.fitness[1] > fitness[1]
+        Fa.Herbivore.set_parameter({'w_half': 20.0})
+        assert pop.fitness[0] < fitness[0]
+
+    def test_keep_and_move(self):
+        """
+        Tests that compaction and moves keep the cell counts right
+        """
+        pop = Po.Population(n_cells=2)
+        pop.add(np.array([0, 0, 1]), 1, np.array([10., 20., 30.]), 0)
+        assert pop.herb_weight(0) == 30
+        pop.move([1], 1)
+        assert pop.herb_weight(0) == 10 and pop.herb_weight(1) == 20
+        pop.remove([0])
+        assert len(pop) == 2
+        assert pop.count(0, Fa.Herbivore) == 0
+        assert pop.count(1, Fa.Herbivore) == 1
+        assert pop.count(0, Fa.Carnivore) == 1
+
+    def test_herb_weights(self):
+        """
+        Tests that herbivore weights are summed per occupied cell, with zero
+        for cells without herbivores, and that counts follow removals
+        """
+        pop = Po.Population(n_cells=4)
+        pop.add(np.array([0, 0, 1, 0]), 1, np.array([10., 5., 7., 2.]),
+                np.array([3, 1, 1, 3]))
+        assert list(pop.herb_weights([0, 1, 3])) == [0, 5, 12]
+        assert list(pop.herb_weights()) == [0, 5, 0, 12]
+        pop.remove([0])
+        assert pop.herb_weight(3) == 2
+        assert pop.counts.tolist() == [[0, 1, 0, 1], [0, 1, 0, 0]]
+
+    def test_bound_cell(self):
+        """
+        Tests that a bound cell keeps its animals in the store
+        """
+        pop = Po.Population(n_cells=1)
+        j = Geo.Jungle()
+        j.populate_cell([Fa.Herbivore(weight=10)])
+        j.bind(pop, 0)
+        j.add_animal(Fa.Carnivore(weight=10))
+        assert len(pop) == 2
+        assert j.herbivore_pop == 1 and j.total_pop == 2
+        assert isinstance(j.pop_carnivores[0], Fa.Carnivore)
+        assert j.get_herb_weight() == 10
+        j.remove_animals(j.pop_herbivores)
+        assert j.herbivore_pop == 0
+
+    def test_totals(self):
+        """
+        Tests that the island totals follow added, moved and removed animals
+        """
+        pop = Po.Population(n_cells=2)
+        pop.add(np.array([0, 0, 1]), 1, 10., np.array([0, 1, 1]))
+        assert list(pop.totals) == [2, 1]
+        pop.move([0], 1)
+        pop.remove([1, 2])
+        assert list(pop.totals) == [1, 0]
+        assert pop.count(animal_class=Fa.Herbivore) == 1
+
+    def test_herbivores_eat(self):
+        """
+        Tests that the fittest herbivore eats first, and that the
+        herbivores of each cell eat from their own cell
+        """
+        fodder = np.array([15., 100., 0.])
+        pop = Po.Population(n_cells=3)
+        pop.add(0, 1, np.array([5., 30., 5., 5.]), np.array([0, 0, 1, 2]))
+        pop.herbivores_eat(fodder)
+        assert list(pop.weight) == [9.5, 39, 14, 5]
+        assert list(fodder) == [0, 90, 0]
+
+    def test_carnivores_eat(self):
+        """
+        Tests that killed herbivores are removed and the carnivores gain
+        weight, and that herbivores in other cells are left alone
+        """
+        Fa.Carnivore.set_parameter({'DeltaPhiMax': 0.1})
+        pop = Po.Population(n_cells=2, rng=np.random.default_rng(2))
+        pop.add(0, 100, np.full(4, 20.), np.array([0, 0, 0, 1]))
+        pop.add(1, 5, 30., 0)
+        pop.carnivores_eat()
+        assert pop.count(0, Fa.Herbivore) == 0
+        assert pop.count(1, Fa.Herbivore) == 1
+        assert pop.weight[pop.species == 1][0] == (
+            30 + 2 * 20 * 0.75 + 10 * 0.75)
+
+    def test_mating(self):
+        """
+        Tests that newborns are added to the cell of the mother with age 0
+        and that the mother loses xi times the birth weight
+        """
+        pop = Po.Population(n_cells=2, rng=np.random.default_rng(3))
+        pop.add(0, 1, 100., np.array([1] * 10))
+        pop.mating()
+        assert pop.count(1, Fa.Herbivore) == 20
+        newborns = pop.age == 0
+        assert (pop.cell[newborns] == 1).all()
+        assert pop.weight[~newborns] == pytest.approx(
+            100 - 1.2 * pop.weight[newborns])
+
+    def test_aging(self):
+        """
+        Tests that every animal ages and loses weight
+        """
+        pop = Po.Population(n_cells=1)
+        pop.add(np.array([0, 1]), np.array([1, 0]), np.array([5., 10.]), 0)
+        pop.aging()
+        assert list(pop.age) == [2, 1]
+        assert list(pop.weight) == [4.75, 8.75]
+
+    def test_dying(self):
+        """
+        Tests that animals with zero weight die
+        """
+        pop = Po.Population(n_cells=1, rng=np.random.default_rng(51))
+        pop.add(0, 10, np.array([0., 20.]), 0)
+        pop.dying()
+        assert len(pop) == 1 and pop.weight[0] == 20
+
+    def test_lazy_aging(self):
+        """
+        Tests that ages and weights follow the years counted by the store,
+        also when read through a view, and that a new eta only applies to
+        the years after it was set
+        """
+        pop = Po.Population(n_cells=1)
+        pop.add(0, 2, 10., 0)
+        for _ in range(3):
+            pop.aging()
+        herb = pop.view(0)
+        assert herb.age == 5
+        assert herb.weight == pytest.approx(10 * 0.95 ** 3)
+        assert pop.weight[0] == pytest.approx(10 * 0.95 ** 3)
+        herb.weight = 20
+        pop.aging()
+        Fa.Herbivore.set_parameter({'eta': 0.5})
+        pop.aging()
+        assert list(pop.age) == [7]
+        assert pop.weight[0] == pytest.approx(20 * 0.95 * 0.5)
+
+    def test_fitness_order(self):
+        """
+        Tests that rows are ordered by cell and fittest first, and that the
+        order follows weight changes and added animals
+        """
+        pop = Po.Population(n_cells=2)
+        pop.add(0, 5, np.array([10., 30., 20., 40.]), np.array([1, 0, 1, 0]))
+        order = pop.fitness_order(Fa.Herbivore)
+        assert list(order) == [3, 1, 2, 0]
+        cells, start, end = pop.segments(Fa.Herbivore)
+        assert list(cells) == [0, 1]
+        assert list(start) == [0, 2] and list(end) == [2, 4]
+        pop.set_weight(0, 50.)
+        assert list(pop.fitness_order(Fa.Herbivore)) == [3, 1, 0, 2]
+        pop.add(0, 5, 35., 0)
+        assert list(pop.fitness_order(Fa.Herbivore)) == [3, 4, 1, 0, 2]
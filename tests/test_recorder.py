@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
+__email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
+
+from biosim import Recorder as Re
+from biosim.simulation import BioSim
+import numpy as np
+import pytest
+
+
+class TestRecorder:
+    """
+    Tests for the memory-mapped Recorder
+    """
+    @pytest.fixture
+    def sim(self):
+        return BioSim(island_map="OOOOO\nOJJSO\nOOOOO",
+                      ini_pop=[{'loc': (1, 1),
+                                'pop': [{'species': 'Herbivore', 'age': 5,
+                                         'weight': 20} for _ in range(20)]}],
+                      seed=1)
+
+    def test_record_and_load(self, sim, tmp_path):
+        """
+        Tests that the files grow past the first capacity, are cut to the
+        recorded years on close and hold the state of the island
+        """
+        recorder = Re.Recorder(tmp_path, capacity=2, percentiles=(50,))
+        sim.simulate(3, vis_years=None, recorder=recorder)
+        sim.simulate(2, vis_years=None, recorder=recorder)
+        assert recorder.capacity == 8
+        recorder.close()
+        data = Re.Recorder.load(tmp_path)
+        assert isinstance(data['totals'], np.memmap)
+        assert list(data['year']) == [1, 2, 3, 4, 5]
+        assert list(data['totals'][-1]) == [sim.num_animals, 0]
+        assert data['counts'].shape == (5, 2, 3, 5)
+        assert (data['counts'][-1, 0] == sim.map.census()[0]).all()
+        assert data['fodder'][-1, 1, 1] == pytest.approx(
+            sim.map.island[1, 1].fodder)
+        assert data['traits'].shape == (5, 2, 3, 2)
+        assert data['traits'][0, 0, 0, 0] == pytest.approx(6)
+        assert np.isnan(data['traits'][:, 1]).all()
+        with pytest.raises(RuntimeError):
+            recorder.record(6, sim.map)
+
+    def test_without_cells(self, sim, tmp_path):
+        """
+        Tests that only the island series are written with cells=False
+        """
+        with Re.Recorder(tmp_path, cells=False) as recorder:
+            sim.simulate(2, vis_years=None, recorder=recorder)
+        data = Re.Recorder.load(tmp_path)
+        assert sorted(data) == ['totals', 'traits', 'year']
+        assert len(data['year']) == 2
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Sjur Spjeld Klemetsen, Ola Flesche Hellenes'
+__email__ = 'sjkl@nmbu.no, olhellen@nmbu.no'
+
+from biosim.simulation import BioSim
+import asyncio
+import numpy as np
+import pytest
+import subprocess
+import sys
+
+
+class TestBioSim:
+    """
+    Tests for the BioSim class
+    """
+    def test_headless_simulate(self):
+        """
+        Tests that a simulation without visualization counts the years and
+        changes the population without creating a figure
+        """
+        sim = BioSim(island_map="OOOO\nOJSO\nOOOO",
+                     ini_pop=[{'loc': (1, 1),
+                               'pop': [{'species': 'Herbivore', 'age': 5,
+                                        'weight': 20} for _ in range(20)]}],
+                     seed=1)
+        sim.simulate(num_years=5, vis_years=None)
+        sim.simulate(num_years=3, vis_years=None, img_years=1)
+        assert sim.year == 8
+        assert sim.fig is None
+        assert sim.num_animals != 20
+
+    def test_lazy_imports(self):
+        """
+        Tests that importing and running a headless simulation does not load
+        pandas or matplotlib
+        """
+        code = ("import sys\n"
+                "from biosim.simulation import BioSim\n"
+                "sim = BioSim('OOO\\nOJO\\nOOO', [], seed=1)\n"
+                "sim.simulate(2, vis_years=None)\n"
+                "print(sorted(m for m in ('pandas', 'matplotlib')"
+                " if m in sys.modules))")
+        out = subprocess.run([sys.executable, '-c', code], check=True,
+                             capture_output=True, text=True).stdout
+        assert out.strip() == '[]'
+
+    def test_heat_maps_updated(self):
+        """
+        Tests that the heat maps are created once and show the counts of the
+        latest visualized year
+        """
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        sim = BioSim(island_map="OOOO\nOJSO\nOOOO",
+                     ini_pop=[{'loc': (1, 1),
+                               'pop': [{'species': 'Herbivore', 'age': 5,
+                                        'weight': 20} for _ in range(20)]}],
+                     seed=1)
+        sim.img_base = None
+        sim.simulate(num_years=3, vis_years=1)
+        image = sim.herb_density
+        sim.simulate(num_years=3, vis_years=1)
+        assert sim.herb_density is image
+        assert len(sim.ax_heat_h.images) == 1
+        assert len(sim.ax_heat_c.images) == 1
+        sim.heat_map_herbivore()
+        assert image.get_array()[1, 1] == sim.map.island[1, 1].herbivore_pop
+        plt.close(sim.fig)
+
+    def test_iter_years(self):
+        """
+        Tests that snapshots are yielded every few years with counts that
+        match the totals, and that the years are simulated as they are read
+        """
+        sim = BioSim(island_map="OOOO\nOJSO\nOOOO",
+                     ini_pop=[{'loc': (1, 1),
+                               'pop': [{'species': 'Herbivore', 'age': 5,
+                                        'weight': 20} for _ in range(20)]}],
+                     seed=1)
+        years = sim.iter_years(6, every=2, traits=True)
+        first = next(years)
+        assert first['year'] == 2 and sim.year == 2
+        assert first['counts']['Herbivore'].shape == (3, 4)
+        assert first['counts']['Herbivore'].sum() == \
+            first['totals']['Herbivore']
+        assert first['traits']['Herbivore']['age'] > 0
+        assert np.isnan(first['traits']['Carnivore']['fitness'])
+        assert [snap['year'] for snap in years] == [4, 6]
+        assert sim.year == 6
+
+    def test_run_async(self):
+        """
+        Tests that the async driver publishes snapshots to a queue, stops at
+        the deadline, and leaves the simulation consistent and the queue
+        terminated when cancelled
+        """
+        def make_sim():
+            return BioSim(island_map="OOOO\nOJSO\nOOOO",
+                          ini_pop=[{'loc': (1, 1),
+                                    'pop': [{'species': 'Herbivore',
+                                             'age': 5, 'weight': 20}
+                                            for _ in range(20)]}],
+                          seed=1)
+
+        async def consume():
+            queue = asyncio.Queue()
+            sim = make_sim()
+            year = await sim.run_async(4, queue=queue, every=2)
+            snapshots = []
+            while True:
+                snapshot = await queue.get()
+                if snapshot is None:
+                    break
+                snapshots.append(snapshot)
+            return year, [snap['year'] for snap in snapshots]
+
+        assert asyncio.run(consume()) == (4, [2, 4])
+
+        async def stop_at_deadline():
+            return await make_sim().run_async(10, deadline=0)
+
+        assert asyncio.run(stop_at_deadline()) == 0
+
+        async def cancel():
+            sim = make_sim()
+            queue = asyncio.Queue()
+            task = asyncio.ensure_future(sim.run_async(10 ** 6, queue=queue))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            snapshots = [queue.get_nowait() for _ in range(queue.qsize())]
+            assert snapshots[-1] is None
+            assert all(snap is not None for snap in snapshots[:-1])
+            year = sim.year
+            assert 0 < year < 10 ** 6
+            await asyncio.sleep(0.05)
+            assert sim.year == year
+            assert sim.map.census()[0].sum() == sim.num_animals
+
+        asyncio.run(cancel())
+
+        async def cancel_full_queue():
+            sim = make_sim()
+            queue = asyncio.Queue(maxsize=1)
+            task = asyncio.ensure_future(sim.run_async(10 ** 6, queue=queue))
+            while not queue.full():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert not sim.end_of_run.done()
+            assert (await queue.get()) is not None
+            assert (await queue.get()) is None
+            await sim.end_of_run
+
+        asyncio.run(cancel_full_queue())